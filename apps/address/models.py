@@ -3,10 +3,12 @@
 from __future__ import unicode_literals
 
 from django.db import models
+from django.db.models import signals
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation.trans_real import get_language
 
 from nnmware.core.fields import std_text_field
+from nnmware.core.geoindex import geo_changed
 from nnmware.core.maps import osm_geocoder
 from nnmware.core.abstract import AbstractName, upload_images_path
 
@@ -250,3 +252,9 @@ class Institution(AbstractName):
 
     def __str__(self):
         return "%s" % self.name
+
+
+signals.post_save.connect(geo_changed, sender=Tourism, dispatch_uid="nnmware_geo_tourism")
+signals.post_delete.connect(geo_changed, sender=Tourism, dispatch_uid="nnmware_geo_tourism")
+signals.post_save.connect(geo_changed, sender=StationMetro, dispatch_uid="nnmware_geo_metro")
+signals.post_delete.connect(geo_changed, sender=StationMetro, dispatch_uid="nnmware_geo_metro")
@@ -3,11 +3,8 @@
 from __future__ import unicode_literals
 
 import json
-import time
-from datetime import datetime, timedelta
-from hashlib import sha1
+from datetime import timedelta
 
-from django.core.cache import cache
 from django.core.mail import mail_managers
 from django.db import transaction
 from django.db.models import Q
@@ -19,9 +16,13 @@ from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.cache import never_cache
 
 from nnmware.apps.address.models import City
-from nnmware.apps.booking.models import SettlementVariant, PlacePrice, Room, Availability, Hotel, RequestAddHotel, \
+from nnmware.apps.booking.models import SettlementVariant, Room, Availability, Hotel, RequestAddHotel, \
     Review, Booking, PaymentMethod, Discount, RoomDiscount, SimpleDiscount, STATUS_ACCEPTED, STATUS_CONFIRMED, \
     STATUS_CANCELED_CLIENT
+from nnmware.apps.booking.maptiles import map_tiles
+from nnmware.apps.booking.rates import rates_from_grid, bulk_save_rates
+from nnmware.apps.booking.search import refresh_room_calendar, price_summary_hotels
+from nnmware.apps.booking.searchcache import get_cached_search, path_search_key
 from nnmware.apps.money.models import Currency, Bill, BILL_UNKNOWN
 from nnmware.core.ajax import ajax_answer_lazy
 from nnmware.core.exceptions import AccessError
@@ -50,49 +51,9 @@ def room_rates(request):
         hotel = Hotel.objects.get(id=int(json_data['hotel']))
         if request.user not in hotel.admins.all() and not request.user.is_superuser:
             raise UserNotAllowed
-            # find settlements keys in data
-        all_rooms, all_avail, all_limits = [], [], []
-        for k in json_data.keys():
-            if k[0] == 'r':
-                all_rooms.append(k)
-            elif k[0] == 'a':
-                all_avail.append(k)
-            elif k[0] == 'l':
-                all_limits.append(k)
-        for i, v in enumerate(json_data['dates']):
-            on_date = datetime.fromtimestamp(time.mktime(time.strptime(v, "%d%m%Y")))
-            for k in all_rooms:
-                try:
-                    settlement_id = int(k[1:])
-                    settlement = SettlementVariant.objects.get(id=settlement_id)
-                    price = int(json_data[k][i])
-                    placeprice, created = PlacePrice.objects.get_or_create(date=on_date, settlement=settlement)
-                    placeprice.amount = price
-                    placeprice.currency = currency
-                    placeprice.save()
-                except ValueError as valerr:
-                    pass
-            for k in all_avail:
-                try:
-                    room_id = int(k[1:])
-                    room = Room.objects.get(pk=room_id)
-                    p = json_data[k][i]
-                    if len(p.strip()) == 0:
-                        placecount = 0
-                    else:
-                        placecount = int(p)
-                    availability, created = Availability.objects.get_or_create(date=on_date, room=room)
-                    availability.placecount = placecount
-                    try:
-                        min_days = int(json_data['l' + k[1:]][i])
-                    except:
-                        min_days = None
-                    if min_days is not None:
-                        availability.min_days = min_days
-                    availability.save()
-                except ValueError as valerr:
-                    pass
-        payload = dict(success=True)
+        prices, avail = rates_from_grid(json_data)
+        result = bulk_save_rates(hotel, prices, avail, currency)
+        payload = dict(success=True, **result)
     except UserNotAllowed as naerr:
         payload = dict(success=False)
     except:
@@ -315,14 +276,10 @@ def filter_hotels_on_map(request, hotels):
         stars = request.POST.getlist('stars') or None
         if amount_max and amount_min:
             if f_date:
-                from_date = convert_to_date(f_date)
-                hotels_with_amount = PlacePrice.objects.filter(date=from_date,
-                    amount__range=(amount_min, amount_max)).values_list('settlement__room__hotel__pk',
-                    flat=True).distinct()
+                on_date = convert_to_date(f_date)
             else:
-                hotels_with_amount = PlacePrice.objects.filter(date=now(),
-                    amount__range=(amount_min, amount_max)).values_list('settlement__room__hotel__pk',
-                    flat=True).distinct()
+                on_date = now()
+            hotels_with_amount = price_summary_hotels(on_date, amount_min, amount_max)
             searched = searched.filter(pk__in=hotels_with_amount, work_on_request=False)
         if options:
             for option in options:
@@ -350,8 +307,7 @@ def hotels_in_city(request):
         c = request.POST['city']
         path = request.POST['path'] or None
         if path:
-            key = sha1('%s' % (path,)).hexdigest()
-            data_key = cache.get(key)
+            data_key = get_cached_search(path_search_key(path)) or []
             searched = Hotel.objects.filter(pk__in=data_key)
         else:
             city = City.objects.get(pk=c)
@@ -371,6 +327,17 @@ def hotels_in_country(request):
     return ajax_answer_lazy(payload)
 
 
+def hotels_on_map(request):
+    """ Clusters or hotels in tiles of visible box of map """
+    try:
+        box = [float(request.POST[k]) for k in ('min_lat', 'max_lat', 'min_lng', 'max_lng')]
+        zoom = int(request.POST['zoom'])
+        payload = {'success': True, 'tiles': map_tiles(*box, zoom=zoom)}
+    except:
+        payload = dict(success=False)
+    return ajax_answer_lazy(payload)
+
+
 def payment_method(request):
     try:
         p_m = request.POST['p_m']
@@ -417,6 +384,7 @@ def booking_sysadm(request, pk, action):
                 avail.placecount += 1
                 avail.save()
                 from_date += timedelta(days=1)
+            refresh_room_calendar([settlement.room], booking.from_date, booking.to_date)
             # TODO RETURN MAIL
             #booking_delete_client_mail(booking)
             booking.delete()
@@ -0,0 +1,57 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from nnmware.apps.booking.models import HotelSearch, SearchDemand
+from nnmware.core.buffer import BulkBuffer
+from nnmware.core.utils import setting
+
+
+def update_demand(searches):
+    """ Add searches to counts of demand per city, check-in date and guests """
+    counts = Counter((s.city, s.from_date, int(s.guests or 0)) for s in searches if s.city)
+    for (city, from_date, guests), count in counts.items():
+        demand = SearchDemand.objects.filter(city=city, date=from_date, guests=guests)
+        if demand.update(searches=F('searches') + count):
+            continue
+        try:
+            with transaction.atomic():
+                SearchDemand.objects.create(city=city, date=from_date, guests=guests, searches=count)
+        except IntegrityError as interr:
+            # created by another process
+            demand.update(searches=F('searches') + count)
+
+
+search_buffer = BulkBuffer(HotelSearch, size=setting('HOTEL_SEARCH_BUFFER_SIZE', 1000),
+                           interval=setting('HOTEL_SEARCH_FLUSH_INTERVAL', 5),
+                           batch_size=setting('HOTEL_SEARCH_BATCH_SIZE', 500), on_flush=update_demand)
+
+
+def log_search(request, from_date, to_date, guests, city, hotel=''):
+    h_s = HotelSearch()
+    h_s.date = now()
+    h_s.from_date = from_date
+    h_s.to_date = to_date
+    if guests:
+        h_s.guests = guests
+    if request.user.is_authenticated:
+        h_s.user = request.user
+    h_s.user_agent = request.META.get('HTTP_USER_AGENT', '')[:255]
+    h_s.ip = request.META.get('REMOTE_ADDR', '')
+    h_s.city = city
+    h_s.hotel = hotel
+    if setting('HOTEL_SEARCH_BUFFER', True):
+        search_buffer.add(h_s)
+    else:
+        # noinspection PyBroadException
+        try:
+            h_s.save()
+            update_demand([h_s])
+        except:
+            pass
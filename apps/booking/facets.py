@@ -0,0 +1,198 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import namedtuple, Counter
+
+from django.core.cache import cache
+from django.db.models import Min, Max
+from django.utils.timezone import now
+
+from nnmware.apps.booking.models import Hotel, PlacePrice
+from nnmware.core.utils import setting
+
+# options is bitmask of hotel options, bit of option is in HotelSummaries.option_bits,
+# min_price and max_price is range of future prices of enabled settlements
+HotelSummary = namedtuple('HotelSummary', 'stars options min_price max_price')
+
+
+class HotelSummaries(object):
+    """
+    Process level summaries of all hotels: stars, options and range of future prices.
+    All is loaded by 3 queries once a day. Changed hotels is reloaded in this process at once
+    and in others after reading of log of changed hotels in cache, which is checked
+    not often then once in FACETS_CHECK seconds. Summaries is replaced by new dict, not changed in place.
+    """
+    version_key = 'hotel_summaries_version'
+    log_size = 1000
+
+    def __init__(self):
+        self.summaries = dict()
+        self.option_bits = dict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._day = None
+        self._checked = 0
+
+    def _log_key(self, version):
+        return 'hotel_summaries_changed_%s' % version
+
+    def _load(self, hotels=None):
+        """ {hotel pk: HotelSummary} of hotels (all by default) """
+        today = now().date()
+        queryset = Hotel.objects.all()
+        prices = PlacePrice.objects.filter(date__gte=today, amount__gt=0, settlement__enabled=True)
+        if hotels is not None:
+            queryset = queryset.filter(pk__in=hotels)
+            prices = prices.filter(settlement__room__hotel__in=hotels)
+        options = dict()
+        for hotel_id, option_id in Hotel.option.through.objects.filter(hotel__in=queryset).\
+                values_list('hotel_id', 'hoteloption_id'):
+            with self._lock:
+                bit = self.option_bits.setdefault(option_id, 1 << len(self.option_bits))
+            options[hotel_id] = options.get(hotel_id, 0) | bit
+        amounts = dict((hotel_id, (amount_min, amount_max)) for hotel_id, amount_min, amount_max in
+                       prices.order_by().values('settlement__room__hotel').
+                       annotate(amount_min=Min('amount'), amount_max=Max('amount')).
+                       values_list('settlement__room__hotel', 'amount_min', 'amount_max'))
+        return dict((hotel_id, HotelSummary(stars, options.get(hotel_id, 0), *amounts.get(hotel_id, (None, None))))
+                    for hotel_id, stars in queryset.values_list('pk', 'starcount'))
+
+    def _update(self, hotels):
+        """ Reload summaries of hotels, deleted hotels is dropped """
+        loaded = self._load(hotels)
+        with self._lock:
+            summaries = dict(self.summaries)
+            for pk in hotels:
+                summaries.pop(pk, None)
+            summaries.update(loaded)
+            self.summaries = summaries
+
+    def _changed_hotels(self, old, version):
+        """ Set of hotels changed after version old, None if all must be reloaded """
+        if old is None or not 0 < version - old <= self.log_size:
+            return None
+        keys = [self._log_key(v) for v in range(old + 1, version + 1)]
+        changed = cache.get_many(keys)
+        if len(changed) < len(keys):
+            # log is expired
+            return None
+        result = set()
+        for hotels in changed.values():
+            if hotels is None:
+                return None
+            result.update(hotels)
+        return result
+
+    def _check(self):
+        today = now().date()
+        if self._day == today and time.time() - self._checked < setting('FACETS_CHECK', 60):
+            return
+        version = cache.get(self.version_key) or 0
+        if self._day != today:
+            self.summaries = self._load()
+            self._day = today
+        elif version != self._version:
+            changed = self._changed_hotels(self._version, version)
+            if changed is None:
+                self.summaries = self._load()
+            elif changed:
+                self._update(changed)
+        self._version = version
+        self._checked = time.time()
+
+    def get_many(self, hotels):
+        self._check()
+        summaries = self.summaries
+        missing = [pk for pk in hotels if pk not in summaries]
+        if missing:
+            # hotels is added after loading
+            self._update(missing)
+            summaries = self.summaries
+        return [(pk, summaries[pk]) for pk in hotels if pk in summaries]
+
+    def invalidate(self, hotels=None):
+        """ Reload summaries of hotels (all if None) here and in other processes """
+        hotels = None if hotels is None else list(hotels)
+        try:
+            version = cache.incr(self.version_key)
+        except ValueError as valerr:
+            version = 1
+            cache.set(self.version_key, version, None)
+        cache.set(self._log_key(version), hotels, setting('FACETS_LOG_TTL', 3600))
+        if self._day is None:
+            # nothing is loaded in this process
+            return
+        if hotels is None:
+            self._day = None
+            self._checked = 0
+        else:
+            self._update(hotels)
+
+
+hotel_summaries = HotelSummaries()
+
+
+class Facets(object):
+    """
+    Result of one pass over hotels found by search:
+        hotels - pk's of hotels, which pass filters by stars, options and amount
+        stars - {starcount: count of found hotels}
+        options - {option pk: count of found hotels}
+        amount_min, amount_max - range of future prices of hotels, which pass filters
+    """
+
+    def __init__(self, hotels, stars, options, amount_min, amount_max):
+        self.hotels = hotels
+        self.stars = stars
+        self.options = options
+        self.amount_min = amount_min
+        self.amount_max = amount_max
+
+    def stars_count(self):
+        """ Counts of stars in form of values('starcount').annotate(Count('starcount')) """
+        return [{'starcount': s, 'starcount__count': self.stars[s]} for s in sorted(self.stars)]
+
+
+def hotel_facets(hotels, stars=None, options=None, with_amount=None):
+    """
+    Facets of hotels (list of pk's) with filters: stars - list of starcounts,
+    options - list of option pk's, which hotel must have all, with_amount - set of pk's of hotels with price in range.
+    """
+    summaries = hotel_summaries.get_many(hotels)
+    star_filter = set(int(s) for s in stars) if stars else None
+    option_mask = None
+    if options:
+        option_mask = 0
+        for option in options:
+            try:
+                bit = hotel_summaries.option_bits.get(int(option))
+            except ValueError as valerr:
+                bit = None
+            if bit is None:
+                # nobody has this option
+                option_mask = -1
+                break
+            option_mask |= bit
+    found, star_counts, option_counts = [], Counter(), Counter()
+    amount_min = amount_max = None
+    bits = [(bit, option_id) for option_id, bit in hotel_summaries.option_bits.items()]
+    for pk, summary in summaries:
+        star_counts[summary.stars] += 1
+        if summary.options:
+            for bit, option_id in bits:
+                if summary.options & bit:
+                    option_counts[option_id] += 1
+        if star_filter is not None and summary.stars not in star_filter:
+            continue
+        if option_mask is not None and (option_mask < 0 or summary.options & option_mask != option_mask):
+            continue
+        if with_amount is not None and pk not in with_amount:
+            continue
+        found.append(pk)
+        if summary.min_price is not None:
+            amount_min = summary.min_price if amount_min is None else min(amount_min, summary.min_price)
+            amount_max = summary.max_price if amount_max is None else max(amount_max, summary.max_price)
+    return Facets(found, dict(star_counts), dict(option_counts), amount_min or 0, amount_max or 0)
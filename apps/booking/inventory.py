@@ -0,0 +1,60 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+
+from nnmware.apps.booking.models import PlacePrice, Availability
+
+
+class RoomSoldOut(Exception):
+    pass
+
+
+def stay_nights(from_date, to_date):
+    return [from_date + timedelta(days=i) for i in range((to_date - from_date).days)]
+
+
+def stay_prices(settlement, hotel, from_date, to_date):
+    """
+    [(date, amount, percent)] for every night of stay by one pass over histories of prices and percents.
+    Raises PlacePrice.DoesNotExist if price of night is not set and IndexError if percent of hotel is not set.
+    """
+    nights = stay_nights(from_date, to_date)
+    if not nights:
+        return []
+    prices = dict(settlement.prices_between(nights[0], nights[-1]))
+    percents = hotel.get_percents_on_dates(nights)
+    result = []
+    for night, percent in zip(nights, percents):
+        if night not in prices:
+            raise PlacePrice.DoesNotExist
+        if percent is None:
+            raise IndexError
+        result.append((night, prices[night], percent))
+    return result
+
+
+def reserve_room(room, from_date, to_date):
+    """
+    Take one place of room on every night of stay by one conditional update.
+    Raises RoomSoldOut and changes nothing if any night has no free places.
+    Rows of nights is locked first and one row per night is taken, as availability may have
+    duplicated rows of room and date.
+    """
+    nights = (to_date - from_date).days
+    with transaction.atomic():
+        rows = dict()
+        for pk, on_date in Availability.objects.select_for_update().filter(
+                room=room, date__gte=from_date, date__lt=to_date, placecount__gt=0).\
+                order_by('date', 'pk').values_list('pk', 'date'):
+            rows.setdefault(on_date, pk)
+        if len(rows) != nights:
+            raise RoomSoldOut
+        updated = Availability.objects.filter(pk__in=rows.values(), placecount__gt=0).\
+            update(placecount=F('placecount') - 1)
+        if updated != nights:
+            raise RoomSoldOut
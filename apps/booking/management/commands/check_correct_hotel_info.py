@@ -1,43 +1,89 @@
 # nnmware(c)2012-2020
 
+import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db.models import Count, Exists, OuterRef
 from django.utils.timezone import now
 from django.utils.translation import activate
 from django.utils.translation import ugettext as _
 
-from nnmware.apps.booking.models import Hotel, Availability, SettlementVariant
-from nnmware.core.utils import send_template_mail
+from nnmware.apps.booking.models import Hotel, Availability, SettlementVariant, Room, PlacePrice
+from nnmware.core.utils import send_template_mass_mail, setting
+
+AVAILABILITY_DAYS = 14
+
+
+def hotel_errors():
+    """
+    {hotel: [[room name, error]]} for all hotels with admins, which not work on request.
+    Checks of all hotels is made by three queries, not per hotel: rooms with their hotels,
+    count of filled days of availability per room and enabled settlements without prices.
+    Hotels is filtered by subquery in each of them.
+    """
+    today = now().date()
+    hotels = Hotel.objects.exclude(admins=None).exclude(work_on_request=True).distinct()
+    room_pks = Room.objects.filter(hotel__in=hotels).values('pk')
+    rooms = list(Room.objects.filter(hotel__in=hotels).select_related('hotel').order_by('hotel', 'pk'))
+    avail = dict(Availability.objects.filter(room__in=room_pks, date__range=(
+        today, today + timedelta(days=AVAILABILITY_DAYS - 1))).order_by().values('room').
+        annotate(days=Count('pk')).values_list('room', 'days'))
+    no_prices = dict()
+    for settlement in SettlementVariant.objects.filter(room__in=room_pks, enabled=True).annotate(
+            has_prices=Exists(PlacePrice.objects.filter(settlement=OuterRef('pk'), date__lte=today))).\
+            filter(has_prices=False):
+        no_prices.setdefault(settlement.room_id, []).append(settlement)
+    result = dict()
+    for room in rooms:
+        errors = []
+        if avail.get(room.pk, 0) < AVAILABILITY_DAYS:
+            errors.append([room.get_name, _('Not filled availability')])
+        for settlement in no_prices.get(room.pk, []):
+            errors.append([room.get_name, _('Not filled price for %s-placed settlement') % settlement.settlement])
+        if errors:
+            result.setdefault(room.hotel, []).extend(errors)
+    return result
+
+
+def hotel_recipients(hotel):
+    return [email for email in (hotel.email, hotel.contact_email) if len(email) > 0]
+
+
+def send_batch(messages):
+    # language is active per thread
+    activate('ru')
+    return send_template_mass_mail(messages)
 
 
 class Command(BaseCommand):
     help = 'Check correct info in hotel cabinet'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--parallel', type=int, default=1,
+                            help='Number of threads sending mail. Only sending is parallel, '
+                                 'checks of all hotels is made before it by three queries')
+        parser.add_argument('--dry-run', action='store_true', help='Print report in JSON, do not send mail')
+
     def handle(self, *args, **options):
         activate('ru')
-        for hotel in Hotel.objects.exclude(admins=None).exclude(work_on_request=True):
-            result = []
-            all_users = []
-            for room in hotel.room_set.all():
-                avail = Availability.objects.filter(room=room, date__range=(
-                    now(), now() + timedelta(days=13))).count()
-                if avail < 14:
-                    avail_err = [room.get_name, _('Not filled availability')]
-                    result.append(avail_err)
-                for settlement in SettlementVariant.objects.filter(room=room, enabled=True):
-                    if settlement.current_amount() is 0:
-                        settlement_err = [room.get_name,
-                                          _('Not filled price for %s-placed settlement') % settlement.settlement]
-                        result.append(settlement_err)
-            if len(result) > 0:
-                if len(hotel.email) > 0:
-                    all_users.append(hotel.email)
-                if len(hotel.contact_email) > 0:
-                    all_users.append(hotel.contact_email)
-                recipients = all_users  # settings.BOOKING_MANAGERS
-                mail_dict = {'hotel_name': hotel.get_name, 'site_name': settings.SITENAME, 'items': result}
-                subject = 'booking/err_hotel_subject.txt'
-                body = 'booking/err_hotel.txt'
-                send_template_mail(subject, body, mail_dict, recipients)
+        errors = hotel_errors()
+        if options['dry_run']:
+            report = [dict(hotel=hotel.pk, name=hotel.get_name, recipients=hotel_recipients(hotel), items=items)
+                      for hotel, items in errors.items()]
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        messages = []
+        for hotel, items in errors.items():
+            recipients = hotel_recipients(hotel)  # settings.BOOKING_MANAGERS
+            if not recipients:
+                continue
+            mail_dict = {'hotel_name': hotel.get_name, 'site_name': settings.SITENAME, 'items': items}
+            messages.append(('booking/err_hotel_subject.txt', 'booking/err_hotel.txt', mail_dict, recipients))
+        batch = setting('MAIL_BATCH_SIZE', 100)
+        batches = [messages[i:i + batch] for i in range(0, len(messages), batch)]
+        with ThreadPoolExecutor(max_workers=max(options['parallel'], 1)) as pool:
+            sent = sum(pool.map(send_batch, batches))
+        self.stdout.write('Sent %d of %d mails' % (sent, len(messages)))
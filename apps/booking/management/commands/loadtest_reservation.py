@@ -0,0 +1,60 @@
+# nnmware(c)2012-2020
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.timezone import now
+
+from nnmware.apps.booking.inventory import RoomSoldOut, reserve_room
+from nnmware.apps.booking.models import Room, Availability
+
+
+class Command(BaseCommand):
+    help = 'Reserve one room from parallel threads and check that no night is oversold. ' \
+           'Availability of room is restored after test, so it runs only with DEBUG on test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('room', type=int, help='Id of room with filled availability')
+        parser.add_argument('--nights', type=int, default=3)
+        parser.add_argument('--threads', type=int, default=20)
+        parser.add_argument('--bookings', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            # restore of availability after test erases bookings made meanwhile
+            raise CommandError('Load test is not allowed without DEBUG, use test database')
+        room = Room.objects.get(pk=options['room'])
+        from_date = now().date()
+        to_date = from_date + timedelta(days=options['nights'])
+        period = Availability.objects.filter(room=room, date__gte=from_date, date__lt=to_date)
+        before = dict(period.values_list('date', 'placecount'))
+        if len(before) == options['nights']:
+            free = max(min(before.values()), 0)
+        else:
+            free = 0
+
+        def book(i):
+            try:
+                reserve_room(room, from_date, to_date)
+                return True
+            except RoomSoldOut as soldout:
+                return False
+            finally:
+                connection.close()
+
+        try:
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                booked = sum(pool.map(book, range(options['bookings'])))
+            after = dict(period.values_list('date', 'placecount'))
+        finally:
+            for on_date, placecount in before.items():
+                Availability.objects.filter(room=room, date=on_date).update(placecount=placecount)
+        self.stdout.write('Free places: %d, booked: %d of %d' % (free, booked, options['bookings']))
+        oversold = booked > free or any(after[d] < 0 for d in after)
+        if oversold or booked != min(free, options['bookings']):
+            self.stderr.write('FAIL: availability after test %s' % after)
+        else:
+            self.stdout.write('OK: no oversell')
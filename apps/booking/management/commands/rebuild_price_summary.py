@@ -0,0 +1,41 @@
+# nnmware(c)2012-2020
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils.timezone import now
+
+from nnmware.apps.booking.models import PlacePrice
+from nnmware.apps.booking.search import refresh_price_summary
+from nnmware.core.utils import convert_to_date
+
+
+class Command(BaseCommand):
+    help = 'Rebuild minimal and maximal prices of hotels per date by chunks of dates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_date', help='First date (dd.mm.yyyy), today by default')
+        parser.add_argument('--to', dest='to_date', help='Last date (dd.mm.yyyy), last date with price by default')
+        parser.add_argument('--chunk', type=int, default=30, help='Days in one transaction')
+
+    def handle(self, *args, **options):
+        if options['from_date']:
+            from_date = convert_to_date(options['from_date']).date()
+        else:
+            from_date = now().date()
+        if options['to_date']:
+            to_date = convert_to_date(options['to_date']).date()
+        else:
+            to_date = PlacePrice.objects.filter(date__gte=from_date).aggregate(Max('date'))['date__max']
+        if not to_date:
+            self.stdout.write('No prices from %s' % from_date)
+            return
+        total = 0
+        while from_date <= to_date:
+            last_date = min(from_date + timedelta(days=max(options['chunk'], 1) - 1), to_date)
+            count = refresh_price_summary(None, from_date, last_date)
+            total += count
+            self.stdout.write('%s - %s: %d rows' % (from_date, last_date, count))
+            from_date = last_date + timedelta(days=1)
+        self.stdout.write('Done, %d rows' % total)
@@ -0,0 +1,20 @@
+# nnmware(c)2012-2020
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils.timezone import now
+
+from nnmware.apps.booking.models import Hotel, PlacePrice
+from nnmware.apps.booking.search import refresh_room_calendar
+
+
+class Command(BaseCommand):
+    help = 'Rebuild calendar of bookable nights for hotel search'
+
+    def handle(self, *args, **options):
+        today = now().date()
+        for hotel in Hotel.objects.all():
+            last_date = PlacePrice.objects.filter(settlement__room__hotel=hotel, date__gte=today).\
+                aggregate(Max('date'))['date__max']
+            if last_date:
+                refresh_room_calendar(hotel.room_set.all(), today, last_date)
@@ -2,12 +2,12 @@
 
 from django.core.management.base import BaseCommand
 
-from nnmware.apps.booking.models import Hotel
+from nnmware.apps.booking.rates import refresh_hotel_amounts
 
 
 class Command(BaseCommand):
     help = 'Recalculate current minimal hotel amount'
 
     def handle(self, *args, **options):
-        for hotel in Hotel.objects.all():
-            hotel.update_hotel_amount()
+        changed = refresh_hotel_amounts()
+        self.stdout.write('Current amount changed for %d hotels' % changed)
@@ -0,0 +1,17 @@
+# nnmware(c)2012-2020
+
+from django.core.management.base import BaseCommand
+
+from nnmware.apps.booking.reports import SNAPSHOT_REPORTS, refresh_report_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Recalculate snapshots of heavy sysadm reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('reports', nargs='*', help='Slugs of reports, by default - all')
+
+    def handle(self, *args, **options):
+        for report_type in options['reports'] or SNAPSHOT_REPORTS:
+            snapshot = refresh_report_snapshot(report_type)
+            self.stdout.write('%s: %d objects' % (report_type, len(snapshot.ids)))
@@ -0,0 +1,99 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+from math import floor
+
+from django.core.cache import cache
+from django.utils.translation.trans_real import get_language
+
+from nnmware.apps.booking.facets import hotel_summaries
+from nnmware.apps.booking.models import Hotel
+from nnmware.core.geoindex import geo_index, geo_index_version
+from nnmware.core.utils import setting
+
+MAX_ZOOM = 18
+
+
+def tile_degrees(zoom):
+    return 360.0 / (2 ** zoom)
+
+
+def tile_box(zoom, x, y):
+    """ (min_lat, max_lat, min_lng, max_lng) of tile """
+    size = tile_degrees(zoom)
+    return y * size - 90, (y + 1) * size - 90, x * size - 180, (x + 1) * size - 180
+
+
+def tiles_of_box(min_lat, max_lat, min_lng, max_lng, zoom):
+    """
+    (zoom, [(x, y)]) of tiles, which cover box. Zoom is decreased until count of tiles
+    is not more then MAP_MAX_TILES, so answer has limited size for any box.
+    """
+    min_lat, max_lat = max(min_lat, -90), min(max_lat, 90)
+    min_lng, max_lng = max(min_lng, -180), min(max_lng, 180)
+    zoom = max(0, min(zoom, MAX_ZOOM))
+    while True:
+        size = tile_degrees(zoom)
+        x1, x2 = int(floor((min_lng + 180) / size)), int(floor((max_lng + 180) / size))
+        y1, y2 = int(floor((min_lat + 90) / size)), int(floor((max_lat + 90) / size))
+        if (x2 - x1 + 1) * (y2 - y1 + 1) <= setting('MAP_MAX_TILES', 16) or not zoom:
+            return zoom, [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+        zoom -= 1
+
+
+def _amount(price):
+    if price is None:
+        return None
+    return int(price)
+
+
+def _clusters(points, prices, box, grid):
+    """ Points grouped in grid x grid cells of box: count, centroid and minimal price of cell """
+    min_lat, max_lat, min_lng, max_lng = box
+    d_lat, d_lng = (max_lat - min_lat) / grid, (max_lng - min_lng) / grid
+    cells = dict()
+    for lat, lng, pk in points:
+        cell = (min(int((lat - min_lat) / d_lat), grid - 1), min(int((lng - min_lng) / d_lng), grid - 1))
+        count, sum_lat, sum_lng, price = cells.get(cell, (0, 0.0, 0.0, None))
+        hotel_price = prices.get(pk)
+        if hotel_price is not None and (price is None or hotel_price < price):
+            price = hotel_price
+        cells[cell] = (count + 1, sum_lat + lat, sum_lng + lng, price)
+    return [{'count': count, 'latitude': sum_lat / count, 'longitude': sum_lng / count, 'amount': _amount(price)}
+            for count, sum_lat, sum_lng, price in cells.values()]
+
+
+def _hotels(points, prices):
+    hotels = Hotel.objects.select_related('city').filter(pk__in=[pk for lat, lng, pk in points]).\
+        only('pk', 'name', 'name_en', 'slug', 'starcount', 'latitude', 'longitude', 'city__slug')
+    return [{'id': hotel.pk, 'name': hotel.get_name, 'latitude': hotel.latitude, 'longitude': hotel.longitude,
+             'starcount': hotel.starcount, 'url': hotel.get_absolute_url(), 'amount': _amount(prices.get(hotel.pk))}
+            for hotel in hotels]
+
+
+def map_tile(zoom, x, y):
+    """
+    Hotels of tile, cached until hotels is moved or MAP_TILE_TTL seconds: on zoom from MAP_HOTELS_ZOOM
+    list of hotels (if not more then MAP_TILE_HOTELS), else clusters of MAP_CLUSTER_GRID x MAP_CLUSTER_GRID grid.
+    """
+    key = 'map_tile_%s_%s_%s_%s_%s' % (geo_index_version(Hotel), get_language(), zoom, x, y)
+    tile = cache.get(key)
+    if tile is not None:
+        return tile
+    box = tile_box(zoom, x, y)
+    # hotels without coordinates is not shown
+    points = [p for p in geo_index(Hotel).in_box(*box) if p[0] or p[1]]
+    prices = dict((pk, summary.min_price) for pk, summary in hotel_summaries.get_many([p[2] for p in points]))
+    tile = {'zoom': zoom, 'x': x, 'y': y, 'count': len(points)}
+    if zoom >= setting('MAP_HOTELS_ZOOM', 13) and len(points) <= setting('MAP_TILE_HOTELS', 100):
+        tile['hotels'] = _hotels(points, prices)
+    else:
+        tile['clusters'] = _clusters(points, prices, box, setting('MAP_CLUSTER_GRID', 8))
+    cache.set(key, tile, setting('MAP_TILE_TTL', 300))
+    return tile
+
+
+def map_tiles(min_lat, max_lat, min_lng, max_lng, zoom):
+    zoom, tiles = tiles_of_box(min_lat, max_lat, min_lng, max_lng, zoom)
+    return [map_tile(zoom, x, y) for x, y in tiles]
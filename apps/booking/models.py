@@ -2,7 +2,6 @@
 
 from __future__ import unicode_literals
 
-import random
 from datetime import timedelta, time, datetime
 from decimal import Decimal
 from uuid import uuid4
@@ -19,10 +18,14 @@ from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation.trans_real import get_language
 
-from nnmware.apps.address.models import AbstractGeo, Tourism, City
+from nnmware.apps.address.models import AbstractGeo, Tourism, City, StationMetro
 from nnmware.apps.money.models import MoneyBase
 from nnmware.core.abstract import AbstractIP, AbstractName, AbstractDate, upload_images_path
-from nnmware.core.maps import places_near_object
+from nnmware.core.geoindex import places_within, places_nearest, geo_changed
+from nnmware.core.idgen import IdAllocator
+from nnmware.core.maps import MILE
+from nnmware.core.timeline import TimelineCache, as_day
+from nnmware.core.utils import setting
 
 
 class HotelPoints(models.Model):
@@ -265,13 +268,17 @@ class Hotel(AbstractName, AbstractGeo, HotelPoints):
         return reverse('cabinet_info', kwargs={'city': self.city.slug, 'slug': self.slug})
 
     def get_current_percent(self):
-        try:
-            return AgentPercent.objects.filter(hotel=self).filter(date__lte=now()).order_by('-date')[0].percent
-        except IndexError as ierr:
-            return None
+        return agent_percents.get(self.pk).at(now())
 
     def get_percent_on_date(self, on_date):
-        return AgentPercent.objects.filter(hotel=self).filter(date__lte=on_date).order_by('-date')[0].percent
+        percent = agent_percents.get(self.pk).at(on_date)
+        if percent is None:
+            raise IndexError
+        return percent
+
+    def get_percents_on_dates(self, dates):
+        """ Percents for every date of stay by one lookup of history """
+        return agent_percents.get(self.pk).each(dates)
 
     @property
     def min_current_amount(self):
@@ -298,19 +305,18 @@ class Hotel(AbstractName, AbstractGeo, HotelPoints):
         super(Hotel, self).save(*args, **kwargs)
 
     def update_hotel_amount(self):
-        amount = self.min_current_amount
-        if amount:
-            self.current_amount = amount
-        else:
-            self.current_amount = 0
-        self.save()
+        from nnmware.apps.booking.rates import refresh_hotel_amounts
+        refresh_hotel_amounts([self.pk])
+        self.current_amount = Hotel.objects.values_list('current_amount', flat=True).get(pk=self.pk)
 
     def tourism_places(self):
-        places = Tourism.objects.raw(places_near_object(self, settings.TOURISM_PLACES_RADIUS, 'address_tourism'))
-        all_places = []
-        for p in places:
-            all_places.append(p.id)
-        return Tourism.objects.filter(pk__in=all_places).order_by('category')
+        # radius in setting is in miles
+        places = places_within(Tourism, self, settings.TOURISM_PLACES_RADIUS * MILE)
+        return Tourism.objects.filter(pk__in=[pk for d, pk in places]).order_by('category')
+
+    def metro_stations(self, k=3):
+        stations = places_nearest(StationMetro, self, k)
+        return StationMetro.objects.filter(pk__in=[pk for d, pk in stations])
 
     def complete_booking_users_id(self):
         # TODO Check status of bookings
@@ -487,18 +493,20 @@ class SettlementVariant(models.Model):
             return "Settlement for hotel %s" % self.room.hotel.get_name
 
     def current_amount(self):
-        result = PlacePrice.objects.filter(settlement=self, date__lte=now()).order_by('-date')
-        if result:
-            return result[0].amount
-        else:
-            return 0
+        return place_prices.get(self.pk).at(now(), 0)
 
     def amount_on_date(self, on_date):
-        result = PlacePrice.objects.filter(settlement=self, date__lte=on_date).order_by('-date')
-        if result:
-            return result[0].amount
-        else:
-            return 0
+        if as_day(on_date) < place_price_start():
+            return PlacePrice.objects.filter(settlement=self, date__lte=on_date).order_by('-date', '-pk').\
+                values_list('amount', flat=True).first() or 0
+        return place_prices.get(self.pk).at(on_date, 0)
+
+    def prices_between(self, from_date, to_date):
+        """ [(date, amount)] of prices in period """
+        if as_day(from_date) < place_price_start():
+            return list(PlacePrice.objects.filter(settlement=self, date__range=(from_date, to_date)).
+                        order_by('date', 'pk').values_list('date', 'amount'))
+        return place_prices.get(self.pk).between(from_date, to_date)
 
     @property
     def min_current_amount(self):
@@ -630,13 +638,15 @@ class Booking(MoneyBase, AbstractIP):
         if not self.uuid:
             self.uuid = uuid4()
         if self.system_id < 1:
-            new_id = random.randint(100000000, 999999999)
-            while Booking.objects.filter(system_id=new_id).count() > 0:
-                new_id = random.randint(100000000, 999999999)
-            self.system_id = new_id
+            self.system_id = booking_ids.next()
         super(Booking, self).save(*args, **kwargs)
 
 
+# Ids made by random before allocator is skipped
+booking_ids = IdAllocator('booking', taken=lambda ids: Booking.objects.filter(system_id__in=ids).
+                          values_list('system_id', flat=True))
+
+
 class AgentPercent(models.Model):
     hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE)
     date = models.DateField(verbose_name=_("From date"), db_index=True)
@@ -830,6 +840,50 @@ class PlacePrice(MoneyBase):
         super(PlacePrice, self).save(*args, **kwargs)
 
 
+class RoomCalendar(models.Model):
+    """
+    Denormalized bookable nights - one row per enabled settlement and date, which have a price
+    and free places in room. Rebuilt from PlacePrice and Availability by refresh_room_calendar.
+    """
+    hotel = models.ForeignKey(Hotel, verbose_name=_('Hotel'), on_delete=models.CASCADE)
+    room = models.ForeignKey(Room, verbose_name=_('Room'), on_delete=models.CASCADE)
+    settlement = models.ForeignKey(SettlementVariant, verbose_name=_('Settlement Variant'), on_delete=models.CASCADE)
+    guests = models.PositiveSmallIntegerField(_("Guests"), default=0)
+    date = models.DateField(verbose_name=_("On date"))
+    min_days = models.IntegerField(verbose_name=_('Minimum days'), blank=True, null=True)
+
+    class Meta:
+        unique_together = ('settlement', 'date')
+        indexes = [models.Index(fields=['date', 'guests'])]
+        verbose_name = _("Room calendar night")
+        verbose_name_plural = _("Room calendar nights")
+
+    def __str__(self):
+        return _("Settlement for %(guests)s guests in room %(room)s bookable on %(date)s") % dict(
+            guests=self.guests, room=self.room_id, date=self.date)
+
+
+class HotelPriceSummary(models.Model):
+    """
+    Minimal and maximal price of enabled settlements of hotel on date.
+    Rebuilt from PlacePrice by refresh_price_summary.
+    """
+    hotel = models.ForeignKey(Hotel, verbose_name=_('Hotel'), on_delete=models.CASCADE)
+    date = models.DateField(verbose_name=_("On date"))
+    amount_min = models.DecimalField(verbose_name=_('Minimal amount'), default=0, max_digits=22, decimal_places=5)
+    amount_max = models.DecimalField(verbose_name=_('Maximal amount'), default=0, max_digits=22, decimal_places=5)
+
+    class Meta:
+        unique_together = ('hotel', 'date')
+        indexes = [models.Index(fields=['date', 'amount_min'])]
+        verbose_name = _("Hotel price summary")
+        verbose_name_plural = _("Hotel price summaries")
+
+    def __str__(self):
+        return _("Prices of hotel %(hotel)s on %(date)s: %(min)s - %(max)s") % dict(
+            hotel=self.hotel_id, date=self.date, min=self.amount_min, max=self.amount_max)
+
+
 class RequestAddHotel(AbstractIP):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('User'), blank=True,
                              null=True, on_delete=models.CASCADE)
@@ -871,6 +925,70 @@ def update_hotel_point(sender, instance, **kwargs):
 
 signals.post_save.connect(update_hotel_point, sender=Review, dispatch_uid="nnmware_id")
 signals.post_delete.connect(update_hotel_point, sender=Review, dispatch_uid="nnmware_id")
+# Histories of agent percents per hotel and of prices per settlement variant
+agent_percents = TimelineCache('agent_percent', lambda hotel_id: AgentPercent.objects.filter(hotel=hotel_id).
+                               order_by('date', 'pk').values_list('date', 'percent'))
+
+
+def place_price_start():
+    """ First date of prices in timelines, older prices is read from db """
+    return now().date() - timedelta(days=setting('PLACE_PRICE_DAYS', 30))
+
+
+def place_price_rows(settlement_id):
+    """ Prices of settlement from place_price_start() and latest price before it """
+    start = place_price_start()
+    prices = PlacePrice.objects.filter(settlement=settlement_id)
+    before = list(prices.filter(date__lt=start).order_by('-date', '-pk').values_list('date', 'amount')[:1])
+    return before + list(prices.filter(date__gte=start).order_by('date', 'pk').values_list('date', 'amount'))
+
+
+place_prices = TimelineCache('place_price', place_price_rows)
+
+
+def agent_percent_changed(sender, instance, **kwargs):
+    agent_percents.invalidate(instance.hotel_id)
+
+
+def hotel_summary_changed(sender, instance, **kwargs):
+    from nnmware.apps.booking.facets import hotel_summaries
+    hotel_summaries.invalidate([instance.pk])
+
+
+def hotel_options_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    from nnmware.apps.booking.facets import hotel_summaries
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        hotel_summaries.invalidate([instance.pk])
+    elif pk_set is not None:
+        hotel_summaries.invalidate(pk_set)
+    else:
+        # option is cleared from unknown hotels
+        hotel_summaries.invalidate()
+
+
+def place_price_changed(sender, instance, **kwargs):
+    from nnmware.apps.booking.rates import refresh_hotel_amounts
+    from nnmware.apps.booking.search import refresh_price_summary
+    from nnmware.apps.booking.facets import hotel_summaries
+    place_prices.invalidate(instance.settlement_id)
+    hotels = list(SettlementVariant.objects.filter(pk=instance.settlement_id).values_list('room__hotel', flat=True))
+    hotel_summaries.invalidate(hotels)
+    refresh_price_summary(hotels, instance.date, instance.date)
+    if instance.date == now().date():
+        refresh_hotel_amounts(hotels)
+
+
+signals.post_save.connect(place_price_changed, sender=PlacePrice, dispatch_uid="nnmware_id")
+signals.post_delete.connect(place_price_changed, sender=PlacePrice, dispatch_uid="nnmware_id")
+signals.post_save.connect(agent_percent_changed, sender=AgentPercent, dispatch_uid="nnmware_id")
+signals.post_delete.connect(agent_percent_changed, sender=AgentPercent, dispatch_uid="nnmware_id")
+signals.post_save.connect(hotel_summary_changed, sender=Hotel, dispatch_uid="nnmware_summary_hotel")
+signals.post_delete.connect(hotel_summary_changed, sender=Hotel, dispatch_uid="nnmware_summary_hotel")
+signals.m2m_changed.connect(hotel_options_changed, sender=Hotel.option.through, dispatch_uid="nnmware_summary_option")
+signals.post_save.connect(geo_changed, sender=Hotel, dispatch_uid="nnmware_geo_hotel")
+signals.post_delete.connect(geo_changed, sender=Hotel, dispatch_uid="nnmware_geo_hotel")
 
 
 class HotelSearch(AbstractIP):
@@ -890,3 +1008,46 @@ class HotelSearch(AbstractIP):
 
     def __str__(self):
         return _('IP %(ip)s - %(date)s') % dict(ip=self.ip, date=self.date)
+
+
+class SearchDemand(models.Model):
+    """
+    Count of searches per city, check-in date and guests
+    """
+    city = models.CharField(verbose_name=_("City"), max_length=100)
+    date = models.DateField(_("Check-in date"))
+    guests = models.PositiveSmallIntegerField(_("Guests"), default=0)
+    searches = models.PositiveIntegerField(_("Searches"), default=0)
+
+    class Meta:
+        unique_together = ('city', 'date', 'guests')
+        verbose_name = _("Search demand")
+        verbose_name_plural = _("Search demand")
+        ordering = ("city", "date", "guests")
+
+    def __str__(self):
+        return "%s :: %s :: %s -> %s" % (self.city, self.date, self.guests, self.searches)
+
+
+class ReportSnapshot(models.Model):
+    """
+    Saved result of heavy sysadm report - ordered ids of objects
+    """
+    report = models.CharField(verbose_name=_("Report"), max_length=50, unique=True)
+    created_date = models.DateTimeField(_("Created date"), default=now)
+    object_ids = models.TextField(verbose_name=_("Objects"), blank=True)
+
+    class Meta:
+        verbose_name = _("Report snapshot")
+        verbose_name_plural = _("Reports snapshots")
+
+    def __str__(self):
+        return "%s :: %s" % (self.report, self.created_date)
+
+    @property
+    def ids(self):
+        return [int(pk) for pk in self.object_ids.split(',') if pk]
+
+    @property
+    def age(self):
+        return now() - self.created_date
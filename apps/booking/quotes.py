@@ -0,0 +1,212 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from nnmware.apps.booking.models import PlacePrice, Availability, SimpleDiscount
+from nnmware.apps.booking.search import as_date
+from nnmware.apps.money.exchange import convert_amount
+
+
+class RoomQuote(object):
+    """
+    Price of room for searched period - lowest valid settlement, sum, average and ub/gb/nr variants
+    """
+
+    def __init__(self, room_id, settlement_id, nights, discount, from_date, delta, rate):
+        self.room_id = room_id
+        self.settlement = settlement_id
+        self.delta = delta
+        self.raw_amount = sum(nights.values())
+        self.amount = convert_amount(self.raw_amount, rate)
+        self.average = convert_amount(self.raw_amount / delta, rate)
+        self.ub, self.gb, self.nr = dict(), dict(), dict()
+        answer = self.amount
+        if discount.ub:
+            if 0 < discount.ub_discount < 100:
+                self.ub['price'] = (answer * (100 - discount.ub_discount)) / 100
+                self.ub['discount'] = discount.ub_discount
+            else:
+                self.ub['price'] = answer
+                self.ub['discount'] = None
+            self.ub['average'] = self.ub['price'] / delta
+            self.ub['variant'] = 'ub'
+        if discount.gb:
+            self.gb['days'] = from_date - timedelta(days=discount.gb_days)
+            if 0 < discount.gb_discount < 100:
+                self.gb['price'] = (answer * (100 - discount.gb_discount)) / 100
+                self.gb['discount'] = discount.gb_discount
+            else:
+                self.gb['price'] = answer
+                self.gb['discount'] = None
+            if 0 < discount.gb_penalty <= 100:
+                room_answer = convert_amount(nights.get(as_date(from_date), 0), rate)
+                if self.gb['discount'] is not None:
+                    self.gb['penalty'] = (room_answer * (100 - self.gb['discount']) * discount.gb_penalty) / 10000
+                else:
+                    self.gb['penalty'] = (room_answer * discount.gb_penalty) / 100
+            else:
+                self.gb['penalty'] = None
+            self.gb['average'] = self.gb['price'] / delta
+            self.gb['variant'] = 'gb'
+        if discount.nr:
+            if 0 < discount.nr_discount < 100:
+                self.nr['price'] = (answer * (100 - discount.nr_discount)) / 100
+                self.nr['discount'] = discount.nr_discount
+            else:
+                self.nr['price'] = answer
+                self.nr['discount'] = None
+            self.nr['average'] = self.nr['price'] / delta
+            self.nr['variant'] = 'nr'
+
+    def variants(self, btype=None):
+        """ Available variants, variant of btype goes first """
+        all_variants = dict(ub=self.ub, gb=self.gb, nr=self.nr)
+        order = ['ub', 'gb', 'nr']
+        if btype in order and all_variants[btype]:
+            order.remove(btype)
+            order.insert(0, btype)
+        return [all_variants[v] for v in order if all_variants[v]]
+
+    def total_cost(self, btype=None):
+        if btype in ['ub', 'gb', 'nr']:
+            variant = getattr(self, btype)
+            if variant:
+                return variant['price']
+        return self.amount
+
+    @property
+    def min_price(self):
+        prices = [v['price'] for v in self.variants()]
+        if prices:
+            return min(prices)
+        return None
+
+
+class QuoteEngine(object):
+    """
+    Quotes all rooms of hotels for period and guests. Every load of hotels costs three queries,
+    all answers after it is read from memory.
+    """
+
+    def __init__(self, from_date, to_date, guests, rate=None, hotels=None):
+        self.from_date = from_date
+        self.to_date = to_date
+        self.guests = guests or 0
+        self.rate = rate
+        self.delta = (to_date - from_date).days
+        self.date_period = (as_date(from_date), as_date(to_date - timedelta(days=1)))
+        self.hotels = dict()
+        self.quotes = dict()
+        if hotels:
+            self.load(hotels)
+
+    def has_hotel(self, hotel_id):
+        return hotel_id in self.hotels
+
+    def load(self, hotels):
+        hotels = set(hotels) - set(self.hotels)
+        if not hotels:
+            return
+        for hotel_id in hotels:
+            self.hotels[hotel_id] = dict()
+        # room -> settlement -> {'settlement', 'enabled', 'nights': {date: amount}}
+        prices = PlacePrice.objects.filter(settlement__room__hotel__in=hotels,
+            settlement__settlement__gte=self.guests, date__range=self.date_period).\
+            values_list('settlement__room__hotel_id', 'settlement__room_id', 'settlement_id',
+                        'settlement__settlement', 'settlement__enabled', 'date', 'amount')
+        for hotel_id, room_id, settlement_id, settlement, enabled, on_date, amount in prices:
+            room = self.hotels[hotel_id].setdefault(room_id, dict(settlements=dict(), nights=dict()))
+            s = room['settlements'].setdefault(settlement_id, dict(settlement=settlement, enabled=enabled,
+                                                                   nights=dict()))
+            s['nights'][on_date] = amount
+        avail = Availability.objects.filter(room__hotel__in=hotels, date__range=self.date_period).\
+            values_list('room__hotel_id', 'room_id', 'date', 'placecount', 'min_days')
+        for hotel_id, room_id, on_date, placecount, min_days in avail:
+            room = self.hotels[hotel_id].setdefault(room_id, dict(settlements=dict(), nights=dict()))
+            room['nights'][on_date] = (placecount, min_days)
+        discounts = dict()
+        for discount in SimpleDiscount.objects.filter(room__hotel__in=hotels).order_by('pk'):
+            discounts.setdefault(discount.room_id, discount)
+        for hotel_id in hotels:
+            for room_id, room in self.hotels[hotel_id].items():
+                self.quotes[room_id] = self._quote(room_id, room, discounts.get(room_id) or SimpleDiscount())
+
+    def _valid_settlements(self, room, enabled_only=False):
+        result = []
+        for settlement_id, s in room['settlements'].items():
+            if enabled_only and not s['enabled']:
+                continue
+            if len([a for a in s['nights'].values() if a > 0]) >= self.delta:
+                result.append((s['settlement'], settlement_id))
+        return sorted(result)
+
+    def _quote(self, room_id, room, discount):
+        valid = self._valid_settlements(room)
+        if not valid:
+            return None
+        settlement_id = valid[0][1]
+        return RoomQuote(room_id, settlement_id, room['settlements'][settlement_id]['nights'], discount,
+                         self.from_date, self.delta, self.rate)
+
+    def quote(self, room):
+        if not self.has_hotel(room.hotel_id):
+            self.load([room.hotel_id])
+        return self.quotes.get(room.pk)
+
+    def available_rooms(self, hotel_id):
+        """ Rooms of hotel, which may be booked on all nights - as Hotel.available_rooms_for_guests_in_period """
+        if not self.has_hotel(hotel_id):
+            self.load([hotel_id])
+        result = []
+        for room_id, room in self.hotels[hotel_id].items():
+            if not self._valid_settlements(room, enabled_only=True):
+                continue
+            nights = room['nights'].values()
+            if [n for n in nights if n[1] is not None and n[1] > self.delta]:
+                continue
+            if len([n for n in nights if n[0] > 0]) >= self.delta:
+                result.append(room_id)
+        return result
+
+    def min_hotel_price(self, hotel_id):
+        """ Minimal price on first night of rooms, which have free places and allow stay of this length """
+        if not self.has_hotel(hotel_id):
+            self.load([hotel_id])
+        first_night = self.date_period[0]
+        amounts = []
+        for room_id, room in self.hotels[hotel_id].items():
+            nights = [n for n in room['nights'].values() if n[1] is not None and n[1] <= self.delta and n[0] > 0]
+            if len(nights) < self.delta:
+                continue
+            for s in room['settlements'].values():
+                amount = s['nights'].get(first_night)
+                if amount is not None and amount > 0:
+                    amounts.append(amount)
+        if amounts:
+            return convert_amount(int(min(amounts)), self.rate)
+        return None
+
+    def min_hotel_cost(self, hotel_id):
+        """ Minimal total cost in all variants of available rooms """
+        result = []
+        for room_id in self.available_rooms(hotel_id):
+            quote = self.quotes.get(room_id)
+            if quote is not None and quote.min_price is not None:
+                result.append(quote.min_price)
+        if result:
+            return min(result)
+        return None
+
+
+def request_quotes(request, from_date, to_date, guests, rate=None):
+    """ Per request map of quote engines """
+    engines = getattr(request, '_booking_quotes', None)
+    if engines is None:
+        engines = dict()
+        setattr(request, '_booking_quotes', engines)
+    key = (from_date, to_date, guests, getattr(rate, 'pk', None))
+    if key not in engines:
+        engines[key] = QuoteEngine(from_date, to_date, guests, rate)
+    return engines[key]
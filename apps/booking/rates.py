@@ -0,0 +1,214 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min
+from django.utils.timezone import now
+
+from nnmware.apps.booking.facets import hotel_summaries
+from nnmware.apps.booking.models import SettlementVariant, PlacePrice, Room, Availability, Hotel, place_prices, \
+    Discount, RoomDiscount
+from nnmware.apps.booking.search import as_date, refresh_room_calendar, refresh_price_summary
+from nnmware.apps.booking.searchcache import invalidate_hotel_search
+
+BULK_BATCH_SIZE = 500
+
+
+def rates_from_grid(json_data):
+    """
+    Split data of cabinet rates grid to cells:
+        prices - {(settlement_id, date): amount}
+        avail - {(room_id, date): (placecount, min_days)}
+    Cells with wrong values is skipped, as before.
+    """
+    dates = [datetime.strptime(v, "%d%m%Y").date() for v in json_data['dates']]
+    prices, avail = dict(), dict()
+    for k in json_data.keys():
+        if k[0] == 'r':
+            try:
+                settlement_id = int(k[1:])
+            except ValueError as valerr:
+                continue
+            for i, on_date in enumerate(dates):
+                try:
+                    prices[(settlement_id, on_date)] = int(json_data[k][i])
+                except (ValueError, TypeError, IndexError):
+                    pass
+        elif k[0] == 'a':
+            try:
+                room_id = int(k[1:])
+            except ValueError as valerr:
+                continue
+            for i, on_date in enumerate(dates):
+                try:
+                    p = json_data[k][i]
+                    if len(p.strip()) == 0:
+                        placecount = 0
+                    else:
+                        placecount = int(p)
+                except (ValueError, AttributeError, IndexError):
+                    continue
+                # noinspection PyBroadException
+                try:
+                    min_days = int(json_data['l' + k[1:]][i])
+                except:
+                    min_days = None
+                avail[(room_id, on_date)] = (placecount, min_days)
+    return prices, avail
+
+
+def rates_grid(hotel, rooms, dates):
+    """
+    Rows of cabinet rates grid of rooms on dates, cells is read by four queries and placed
+    to arrays by offset of date:
+        [{'room': room, 'placecount': [...], 'min_days': [...],
+          'settlements': [(settlement, [amount, ...])], 'discounts': [(discount, [value, ...])]}]
+    Values is in order of sorted dates, empty cell is ''.
+    """
+    days = sorted(set(as_date(d) for d in dates))
+    rooms = list(rooms or ())
+    if not days or not rooms:
+        return []
+    first = days[0]
+    date_period = (first, days[-1])
+    width = (days[-1] - first).days + 1
+    columns = [(d - first).days for d in days]
+    empty = [''] * len(columns)
+
+    def cells(rows):
+        result = dict()
+        for key, on_date, value in rows:
+            result.setdefault(key, [''] * width)[(on_date - first).days] = value
+        return dict((key, [values[i] for i in columns]) for key, values in result.items())
+
+    settlements = list(SettlementVariant.objects.filter(room__in=rooms, enabled=True).order_by('settlement'))
+    discounts = list(Discount.objects.filter(hotel=hotel))
+    prices = cells(PlacePrice.objects.filter(settlement__in=settlements, date__range=date_period).
+                   order_by('date', 'pk').values_list('settlement_id', 'date', 'amount'))
+    avail = list(Availability.objects.filter(room__in=rooms, date__range=date_period).order_by('date', 'pk').
+                 values_list('room_id', 'date', 'placecount', 'min_days'))
+    placecount = cells((room_id, on_date, count) for room_id, on_date, count, days_min in avail)
+    min_days = cells((room_id, on_date, '' if days_min is None else days_min)
+                     for room_id, on_date, count, days_min in avail)
+    room_discounts = cells(((room_id, discount_id), on_date, value) for room_id, discount_id, on_date, value in
+                           RoomDiscount.objects.filter(room__in=rooms, date__range=date_period).
+                           order_by('date', 'pk').values_list('room_id', 'discount_id', 'date', 'value'))
+    result = []
+    for room in rooms:
+        result.append({
+            'room': room,
+            'placecount': placecount.get(room.pk, empty),
+            'min_days': min_days.get(room.pk, empty),
+            'settlements': [(s, prices.get(s.pk, empty)) for s in settlements if s.room_id == room.pk],
+            'discounts': [(d, room_discounts.get((room.pk, d.pk), empty)) for d in discounts]})
+    return result
+
+
+def refresh_rates(hotel, from_date, to_date, prices_changed=True):
+    """
+    Rebuild nights and price summary of hotel in period from_date - to_date (inclusive)
+    and drop caches of its prices after cells is written by bulk_save_rates
+    """
+    with transaction.atomic():
+        refresh_room_calendar(Room.objects.filter(hotel=hotel), from_date, to_date)
+        if prices_changed:
+            refresh_price_summary([hotel.pk], from_date, to_date)
+    cache.delete('hotel_prices')
+    invalidate_hotel_search(hotel)
+    if prices_changed:
+        place_prices.invalidate()
+        hotel_summaries.invalidate([hotel.pk])
+        today = now().date()
+        if as_date(from_date) <= today <= as_date(to_date):
+            refresh_hotel_amounts([hotel.pk], today)
+
+
+def bulk_save_rates(hotel, prices, avail, currency, refresh=True):
+    """
+    Write prices and availability cells of hotel in one transaction with fixed count of queries.
+    With refresh=False nights, summaries and caches is not refreshed, caller must call
+    refresh_rates for all written period once at the end.
+    Returns counts of inserted, updated and unchanged cells and count of inserted and updated prices.
+    """
+    result = dict(inserted=0, updated=0, unchanged=0, prices_changed=0)
+    all_dates = [d for s, d in prices] + [d for r, d in avail]
+    if not all_dates:
+        return result
+    date_period = (min(all_dates), max(all_dates))
+    settlements = set(SettlementVariant.objects.filter(room__hotel=hotel,
+        pk__in=set(s for s, d in prices)).values_list('pk', flat=True))
+    rooms = set(Room.objects.filter(hotel=hotel, pk__in=set(r for r, d in avail)).values_list('pk', flat=True))
+    exist_prices = dict()
+    for p in PlacePrice.objects.filter(settlement__in=settlements, date__range=date_period):
+        exist_prices.setdefault((p.settlement_id, p.date), p)
+    exist_avail = dict()
+    for a in Availability.objects.filter(room__in=rooms, date__range=date_period):
+        exist_avail.setdefault((a.room_id, a.date), a)
+    new_prices, changed_prices = [], []
+    for (settlement_id, on_date), amount in prices.items():
+        if settlement_id not in settlements:
+            continue
+        placeprice = exist_prices.get((settlement_id, on_date))
+        if placeprice is None:
+            new_prices.append(PlacePrice(settlement_id=settlement_id, date=on_date, amount=amount,
+                                         currency=currency))
+        elif placeprice.amount != amount or placeprice.currency_id != currency.pk:
+            placeprice.amount = amount
+            placeprice.currency = currency
+            changed_prices.append(placeprice)
+        else:
+            result['unchanged'] += 1
+    new_avail, changed_avail = [], []
+    for (room_id, on_date), (placecount, min_days) in avail.items():
+        if room_id not in rooms:
+            continue
+        availability = exist_avail.get((room_id, on_date))
+        if availability is None:
+            new_avail.append(Availability(room_id=room_id, date=on_date, placecount=placecount, min_days=min_days))
+            continue
+        if min_days is None:
+            min_days = availability.min_days
+        if availability.placecount != placecount or availability.min_days != min_days:
+            availability.placecount = placecount
+            availability.min_days = min_days
+            changed_avail.append(availability)
+        else:
+            result['unchanged'] += 1
+    with transaction.atomic():
+        PlacePrice.objects.bulk_create(new_prices, batch_size=BULK_BATCH_SIZE)
+        PlacePrice.objects.bulk_update(changed_prices, ['amount', 'currency'], batch_size=BULK_BATCH_SIZE)
+        Availability.objects.bulk_create(new_avail, batch_size=BULK_BATCH_SIZE)
+        Availability.objects.bulk_update(changed_avail, ['placecount', 'min_days'], batch_size=BULK_BATCH_SIZE)
+    if refresh:
+        refresh_rates(hotel, date_period[0], date_period[1], bool(new_prices or changed_prices))
+    result['inserted'] = len(new_prices) + len(new_avail)
+    result['updated'] = len(changed_prices) + len(changed_avail)
+    result['prices_changed'] = len(new_prices) + len(changed_prices)
+    return result
+
+
+def refresh_hotel_amounts(hotels=None, on_date=None):
+    """
+    Set current_amount of hotels (all by default) to minimal price of enabled settlement on date
+    by one grouped query and bulk update of changed hotels. Returns count of changed hotels.
+    """
+    on_date = on_date or now().date()
+    prices = PlacePrice.objects.filter(settlement__enabled=True, date=on_date)
+    queryset = Hotel.objects.all()
+    if hotels is not None:
+        prices = prices.filter(settlement__room__hotel__in=hotels)
+        queryset = queryset.filter(pk__in=hotels)
+    amounts = dict(prices.order_by().values('settlement__room__hotel').annotate(amount=Min('amount')).
+                   values_list('settlement__room__hotel', 'amount'))
+    changed = []
+    for hotel in queryset.only('pk', 'current_amount'):
+        amount = amounts.get(hotel.pk) or 0
+        if hotel.current_amount != amount:
+            hotel.current_amount = amount
+            changed.append(hotel)
+    Hotel.objects.bulk_update(changed, ['current_amount'], batch_size=BULK_BATCH_SIZE)
+    return len(changed)
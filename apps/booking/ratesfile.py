@@ -0,0 +1,195 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+import codecs
+import csv
+import tempfile
+import zipfile
+from datetime import datetime, date
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError
+
+from nnmware.apps.booking.models import PlacePrice, Availability, SettlementVariant, Room
+from nnmware.apps.booking.rates import bulk_save_rates, refresh_rates
+from nnmware.core.utils import setting
+
+# One row per cell: price of settlement or places and minimal days of room on date,
+# name is for people and is not read on import
+RATES_COLUMNS = ('kind', 'id', 'name', 'date', 'value', 'min_days')
+KIND_PRICE = 'price'
+KIND_AVAIL = 'avail'
+RATES_FORMATS = ('csv', 'xlsx')
+STREAM_CHUNK = 65536
+MAX_ERRORS = 20
+
+
+def export_rates_rows(hotel, from_date=None, to_date=None):
+    """ Generator of header and rows of prices and availability of hotel, rows is read from db by chunks """
+    yield RATES_COLUMNS
+    prices = PlacePrice.objects.filter(settlement__room__hotel=hotel)
+    avail = Availability.objects.filter(room__hotel=hotel)
+    if from_date:
+        prices, avail = prices.filter(date__gte=from_date), avail.filter(date__gte=from_date)
+    if to_date:
+        prices, avail = prices.filter(date__lte=to_date), avail.filter(date__lte=to_date)
+    settlements = dict((s.pk, '%s / %s' % (s.room.name, s.settlement)) for s in
+                       SettlementVariant.objects.filter(room__hotel=hotel).select_related('room'))
+    for settlement_id, on_date, amount in prices.order_by('settlement', 'date').\
+            values_list('settlement_id', 'date', 'amount').iterator(chunk_size=2000):
+        yield KIND_PRICE, settlement_id, settlements.get(settlement_id, ''), on_date.isoformat(), str(amount), ''
+    rooms = dict(Room.objects.filter(hotel=hotel).values_list('pk', 'name'))
+    for room_id, on_date, placecount, min_days in avail.order_by('room', 'date').\
+            values_list('room_id', 'date', 'placecount', 'min_days').iterator(chunk_size=2000):
+        yield KIND_AVAIL, room_id, rooms.get(room_id, ''), on_date.isoformat(), placecount, \
+            '' if min_days is None else min_days
+
+
+class _Echo(object):
+    def write(self, value):
+        return value
+
+
+def csv_stream(rows):
+    writer = csv.writer(_Echo())
+    # BOM is for Excel
+    yield codecs.BOM_UTF8
+    for row in rows:
+        yield writer.writerow(row).encode('utf-8')
+
+
+def xlsx_stream(rows):
+    """ Workbook is written row by row to temporary file, which is sent by chunks """
+    from openpyxl import Workbook
+    book = Workbook(write_only=True)
+    sheet = book.create_sheet('rates')
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as output:
+        book.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(STREAM_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+
+
+def read_rates_rows(fileobj, file_format):
+    """ Generator of rows of uploaded file, file is not read to memory at once """
+    if file_format == 'xlsx':
+        from openpyxl import load_workbook
+        book = load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            for row in book.worksheets[0].iter_rows(values_only=True):
+                yield row
+        finally:
+            book.close()
+    else:
+        for row in csv.reader(codecs.iterdecode(fileobj, 'utf-8-sig')):
+            yield row
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    for date_format in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError('wrong date %s' % value)
+
+
+def _decimal(value, empty=None):
+    if value is None or str(value).strip() == '':
+        return empty
+    try:
+        result = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError('wrong number %s' % value)
+    if not result.is_finite() or result < 0:
+        raise ValueError('wrong number %s' % value)
+    return result
+
+
+def _int(value, empty=None):
+    result = _decimal(value, empty)
+    if result is empty:
+        return empty
+    if result != result.to_integral_value():
+        raise ValueError('not integer %s' % value)
+    return int(result)
+
+
+def parse_rates_row(row):
+    """ ((kind, id, date), value) of row, raises ValueError for wrong row """
+    row = list(row) + [None] * (len(RATES_COLUMNS) - len(row))
+    kind, pk, name, on_date, value, min_days = row[:len(RATES_COLUMNS)]
+    kind = str(kind or '').strip().lower()
+    if kind == KIND_PRICE:
+        return (kind, _int(pk), _date(on_date)), _decimal(value, Decimal(0))
+    if kind == KIND_AVAIL:
+        return (kind, _int(pk), _date(on_date)), (_int(value, 0), _int(min_days))
+    raise ValueError('wrong kind %s' % kind)
+
+
+def import_rates(hotel, rows, currency, chunk=None):
+    """
+    Apply rows of prices and availability to hotel by bulk_save_rates in chunks of cells, so memory
+    is not depends on size of file. Nights, summaries and caches is refreshed once for all imported period.
+    Header and empty rows is skipped, wrong rows is counted.
+    Import is not atomic: if file can't be read or saving fails, chunks saved before stay saved and counted,
+    error is in result['error'].
+    Returns counts of inserted, updated, unchanged, skipped and wrong cells and first errors.
+    """
+    chunk = chunk or setting('RATES_IMPORT_CHUNK', 5000)
+    result = dict(inserted=0, updated=0, unchanged=0, skipped=0, errors=0, error_lines=[], error=None)
+    prices, avail = dict(), dict()
+    saved_period = []
+    prices_changed = False
+
+    def save():
+        nonlocal prices_changed
+        saved = bulk_save_rates(hotel, prices, avail, currency, refresh=False)
+        for k in ('inserted', 'updated', 'unchanged'):
+            result[k] += saved[k]
+        # cells of rooms and settlements of other hotels
+        result['skipped'] += len(prices) + len(avail) - saved['inserted'] - saved['updated'] - saved['unchanged']
+        dates = [d for pk, d in prices] + [d for pk, d in avail]
+        saved_period[:] = [min(saved_period + dates), max(saved_period + dates)]
+        prices_changed = prices_changed or saved['prices_changed'] > 0
+        prices.clear()
+        avail.clear()
+
+    try:
+        for line, row in enumerate(rows, 1):
+            if not row or not any(v not in (None, '') for v in row):
+                continue
+            if line == 1 and str(row[0]).strip().lower() == RATES_COLUMNS[0]:
+                continue
+            try:
+                (kind, pk, on_date), value = parse_rates_row(row)
+            except (ValueError, TypeError) as err:
+                result['errors'] += 1
+                if len(result['error_lines']) < MAX_ERRORS:
+                    result['error_lines'].append('%d: %s' % (line, err))
+                continue
+            if kind == KIND_PRICE:
+                prices[(pk, on_date)] = value
+            else:
+                avail[(pk, on_date)] = value
+            if len(prices) + len(avail) >= chunk:
+                save()
+        if prices or avail:
+            save()
+    except (csv.Error, UnicodeDecodeError, zipfile.BadZipFile, DatabaseError) as err:
+        result['error'] = str(err)
+    finally:
+        if saved_period:
+            refresh_rates(hotel, saved_period[0], saved_period[1], prices_changed)
+    return result
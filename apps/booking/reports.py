@@ -0,0 +1,104 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db.models import Count, Max, F, Q
+from django.utils.timezone import now
+from django.utils.translation import ugettext_lazy as _
+
+from nnmware.apps.address.models import City
+from nnmware.apps.booking.models import Hotel, Room, SettlementVariant, ReportSnapshot
+
+
+def non_correct_hotels():
+    not_filled_room = Room.objects.filter(availability__date__range=(now(),
+        now() + timedelta(days=13))).annotate(num_days=Count('pk')).filter(num_days__lt=14).\
+        order_by('hotel').values_list('hotel__pk', flat=True).distinct()
+    empty_avail_info = Room.objects.exclude(hotel__work_on_request=True).exclude(availability__date__range=
+        (now(), now() + timedelta(days=13))).order_by('hotel').values_list('hotel__pk', flat=True).distinct()
+    not_filled_amount = SettlementVariant.objects.exclude(placeprice__amount=0).\
+        filter(enabled=True, placeprice__date__range=(now(),
+        now() + timedelta(days=13))).annotate(num_days=Count('placeprice__pk')).\
+        filter(num_days__lt=14).order_by('room__hotel').values_list('room__hotel__pk', flat=True).distinct()
+    return Hotel.objects.exclude(admins=None).exclude(work_on_request=True).\
+        filter(Q(pk__in=not_filled_room) | Q(pk__in=not_filled_amount) | Q(pk__in=empty_avail_info)).\
+        order_by('city__name', 'name')
+
+
+def nullroom_hotels():
+    nullroom = Room.objects.filter(availability__date__range=(now(),
+        now() + timedelta(days=13)), availability__placecount=0).annotate(num_days=Count('pk')).\
+        filter(num_days=14).order_by('hotel').values_list('hotel__pk', flat=True).distinct()
+    return Hotel.objects.exclude(admins=None).exclude(work_on_request=True).filter(pk__in=nullroom).\
+        order_by('city__name', 'name')
+
+
+def nullpercent_hotels():
+    return Hotel.objects.filter(agentpercent__date__lte=now()).annotate(Max('agentpercent__date')).\
+        filter(agentpercent__percent=0, agentpercent__date__max=F('agentpercent__date')).\
+        order_by('city__name', 'name')
+
+
+def cities_with_hotels():
+    return City.objects.extra(select={'h_count': """SELECT COUNT(*) FROM booking_hotel WHERE
+        (booking_hotel.enabled = 1 AND booking_hotel.city_id = address_city.id)"""}).order_by('name')
+
+
+# Heavy reports, which is read from snapshot: slug -> (report query, query of page objects)
+SNAPSHOT_REPORTS = {
+    'non-correct': (non_correct_hotels, lambda: Hotel.objects.select_related()),
+    'nullroom': (nullroom_hotels, lambda: Hotel.objects.select_related()),
+    'nullpercent': (nullpercent_hotels, lambda: Hotel.objects.select_related()),
+    'city': (cities_with_hotels, cities_with_hotels),
+}
+
+
+REPORT_NAMES = {
+    'non-correct': _('Hotels, not fully entered info'),
+    'nullroom': _('Hotels, which have null availability on 14 days'),
+    'nullpercent': _('Hotels, with current null percent'),
+    'city': _('Total cities'),
+}
+
+
+def refresh_report_snapshot(report_type):
+    query = SNAPSHOT_REPORTS[report_type][0]
+    ids = ','.join(str(pk) for pk in query().values_list('pk', flat=True))
+    snapshot, created = ReportSnapshot.objects.update_or_create(report=report_type,
+                                                                defaults=dict(object_ids=ids, created_date=now()))
+    return snapshot
+
+
+def report_snapshot(report_type):
+    """ Snapshot of report, made now if not exists """
+    try:
+        return ReportSnapshot.objects.get(report=report_type)
+    except ReportSnapshot.DoesNotExist:
+        return refresh_report_snapshot(report_type)
+
+
+class SnapshotList(object):
+    """
+    Objects of snapshot for paginator - only objects of sliced page is loaded
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.ids = snapshot.ids
+        self.objects = SNAPSHOT_REPORTS[snapshot.report][1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __bool__(self):
+        return bool(self.ids)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        ids = self.ids[item]
+        objects = dict((obj.pk, obj) for obj in self.objects().filter(pk__in=ids))
+        # deleted after snapshot objects is skipped
+        return [objects[pk] for pk in ids if pk in objects]
@@ -0,0 +1,100 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Min, Max
+
+from nnmware.apps.booking.models import RoomCalendar, PlacePrice, Availability, HotelPriceSummary
+
+
+def as_date(d):
+    if isinstance(d, datetime):
+        return d.date()
+    return d
+
+
+def refresh_room_calendar(rooms, from_date, to_date):
+    """
+    Rebuild bookable nights of rooms in period from_date - to_date (inclusive)
+    """
+    date_period = (as_date(from_date), as_date(to_date))
+    avail = dict(((room_id, on_date), min_days) for room_id, on_date, min_days in
+                 Availability.objects.filter(room__in=rooms, date__range=date_period, placecount__gt=0).
+                 values_list('room_id', 'date', 'min_days'))
+    prices = PlacePrice.objects.filter(settlement__room__in=rooms, settlement__enabled=True, date__range=date_period,
+        amount__gt=0).values_list('settlement_id', 'settlement__settlement', 'settlement__room_id',
+        'settlement__room__hotel_id', 'date')
+    nights = []
+    for settlement_id, guests, room_id, hotel_id, on_date in prices:
+        key = (room_id, on_date)
+        if key in avail:
+            nights.append(RoomCalendar(hotel_id=hotel_id, room_id=room_id, settlement_id=settlement_id,
+                                       guests=guests, date=on_date, min_days=avail[key]))
+    with transaction.atomic():
+        RoomCalendar.objects.filter(room__in=rooms, date__range=date_period).delete()
+        RoomCalendar.objects.bulk_create(nights, batch_size=1000)
+    return len(nights)
+
+
+def calendar_hotels(from_date, to_date, guests=None, city=None):
+    """
+    Pk's of hotels, which have settlement for guests bookable on all nights from_date - to_date
+    """
+    need_days = (to_date - from_date).days
+    date_period = (as_date(from_date), as_date(to_date - timedelta(days=1)))
+    nights = RoomCalendar.objects.filter(date__range=date_period).\
+        filter(Q(min_days__isnull=True) | Q(min_days__lte=need_days))
+    if guests:
+        nights = nights.filter(guests__gte=guests)
+    if city:
+        nights = nights.filter(Q(hotel__city=city) | Q(hotel__addon_city=city))
+    return nights.order_by().values('hotel', 'settlement').annotate(num_days=Count('pk')).\
+        filter(num_days__gte=need_days).values_list('hotel', flat=True).distinct()
+
+
+def refresh_price_summary(hotels, from_date, to_date):
+    """
+    Rebuild minimal and maximal prices of enabled settlements of hotels (all if None) per date
+    in period from_date - to_date (inclusive)
+    """
+    date_period = (as_date(from_date), as_date(to_date))
+    prices = PlacePrice.objects.filter(settlement__enabled=True, date__range=date_period, amount__gt=0)
+    summaries = HotelPriceSummary.objects.filter(date__range=date_period)
+    if hotels is not None:
+        prices = prices.filter(settlement__room__hotel__in=hotels)
+        summaries = summaries.filter(hotel__in=hotels)
+    rows = prices.order_by().values('settlement__room__hotel', 'date').\
+        annotate(amount_min=Min('amount'), amount_max=Max('amount')).\
+        values_list('settlement__room__hotel', 'date', 'amount_min', 'amount_max')
+    result = [HotelPriceSummary(hotel_id=hotel_id, date=on_date, amount_min=amount_min, amount_max=amount_max)
+              for hotel_id, on_date, amount_min, amount_max in rows]
+    with transaction.atomic():
+        summaries.delete()
+        HotelPriceSummary.objects.bulk_create(result, batch_size=1000)
+    return len(result)
+
+
+def price_summary_hotels(on_date, amount_min, amount_max):
+    """
+    Set of pk's of hotels with any price on date in range amount_min - amount_max. Hotels, which prices
+    lie in range, is found by summary only, hotels, which prices only overlap range, is checked by prices.
+    """
+    on_date = as_date(on_date)
+    result, overlapped = set(), []
+    for hotel_id, price_min, price_max in HotelPriceSummary.objects.filter(
+            date=on_date, amount_min__lte=amount_max, amount_max__gte=amount_min).\
+            values_list('hotel', 'amount_min', 'amount_max'):
+        if price_min >= Decimal(amount_min) and price_max <= Decimal(amount_max):
+            result.add(hotel_id)
+        else:
+            overlapped.append(hotel_id)
+    if overlapped:
+        result.update(PlacePrice.objects.filter(settlement__enabled=True, date=on_date, amount__gt=0,
+                                                amount__range=(amount_min, amount_max),
+                                                settlement__room__hotel__in=overlapped).
+                      values_list('settlement__room__hotel', flat=True).distinct())
+    return result
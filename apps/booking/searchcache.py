@@ -0,0 +1,134 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+import time
+from datetime import datetime
+from hashlib import sha1
+from urllib.parse import urlencode, urlsplit
+
+from django.core.cache import cache
+from django.http import QueryDict
+from django.urls import resolve, Resolver404
+
+from nnmware.apps.address.models import City
+from nnmware.core.utils import convert_to_date, setting
+
+SEARCH_KEY_PREFIX = 'hotel_search_'
+
+
+def _pk(obj):
+    return getattr(obj, 'pk', obj)
+
+
+def _iso(d):
+    if isinstance(d, datetime):
+        d = d.date()
+    return d.isoformat() if d else ''
+
+
+def city_version_key(city):
+    return '%sversion_%s' % (SEARCH_KEY_PREFIX, _pk(city) or '')
+
+
+def search_key(city=None, from_date=None, to_date=None, guests=None, filters=None):
+    """
+    Key of search result, which not depends on order of parameters in url and on parameters,
+    which not change result. filters is dict of name -> value or list of values.
+    """
+    params = [('city', _pk(city) or ''), ('from', _iso(from_date)), ('to', _iso(to_date)), ('guests', guests or '')]
+    for name in sorted(filters or ()):
+        values = filters[name]
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        params.append((name, ','.join(sorted(str(v) for v in values if v not in (None, '')))))
+    return '%s%s_%s' % (SEARCH_KEY_PREFIX, _pk(city) or '', sha1(urlencode(params).encode('utf-8')).hexdigest())
+
+
+def search_params(city_slug, f_date, t_date, guests):
+    """ (city, from_date, to_date, guests) of hotels search, dates is None if not searched by dates """
+    try:
+        city = City.objects.get(slug=city_slug)
+    except City.DoesNotExist:
+        city = None
+    if f_date and t_date:
+        try:
+            from_date, to_date = sorted([convert_to_date(f_date), convert_to_date(t_date)])
+            return city, from_date, to_date, guests
+        except (ValueError, TypeError):
+            pass
+    return city, None, None, None
+
+
+def path_search_key(path):
+    """ Key of search result of hotels list page with path (as is sent from page by ajax) """
+    url = urlsplit(path)
+    try:
+        city_slug = resolve(url.path).kwargs.get('slug')
+    except Resolver404:
+        city_slug = None
+    query = QueryDict(url.query)
+    try:
+        guests = int(query.get('guests'))
+    except (ValueError, TypeError):
+        guests = None
+    return search_key(*search_params(city_slug, query.get('from'), query.get('to'), guests))
+
+
+def _city_from_key(key):
+    return key[len(SEARCH_KEY_PREFIX):].rsplit('_', 1)[0]
+
+
+def cached_search(key, compute):
+    """
+    Result of compute() cached by key. Only one worker recomputes expired or invalidated result,
+    others get stale result meanwhile. Without any result others wait for it SEARCH_CACHE_WAIT seconds.
+    """
+    version_key = city_version_key(_city_from_key(key))
+    lock_key = key + '_lock'
+    lock_timeout = setting('SEARCH_CACHE_LOCK', 30)
+    deadline = time.time() + setting('SEARCH_CACHE_WAIT', 5)
+    while True:
+        data = cache.get_many([key, version_key])
+        version = data.get(version_key) or 0
+        entry = data.get(key)
+        if entry is not None:
+            value, fresh_until, entry_version = entry
+            if fresh_until > time.time() and entry_version == version:
+                return value
+        if cache.add(lock_key, 1, lock_timeout):
+            break
+        if entry is not None:
+            return value
+        if time.time() > deadline:
+            # worker with lock is too slow, compute without it
+            return compute()
+        time.sleep(0.05)
+    try:
+        value = compute()
+        entry = (value, time.time() + setting('SEARCH_CACHE_TTL', 300), version)
+        cache.set(key, entry, setting('SEARCH_CACHE_STALE_TTL', 3600))
+    finally:
+        cache.delete(lock_key)
+    return value
+
+
+def get_cached_search(key):
+    """ Result by key, fresh or stale, or None """
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    return entry[0]
+
+
+def invalidate_city_search(*cities):
+    """ Results of searches in cities and without city is stale from now """
+    for version_key in set([city_version_key(None)] + [city_version_key(c) for c in cities if c]):
+        try:
+            cache.incr(version_key)
+        except ValueError as valerr:
+            cache.set(version_key, 1, None)
+
+
+def invalidate_hotel_search(hotel):
+    invalidate_city_search(hotel.city_id, hotel.addon_city_id)
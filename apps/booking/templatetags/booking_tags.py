@@ -2,32 +2,38 @@
 
 from __future__ import unicode_literals
 from datetime import timedelta
-from hashlib import sha1
 
-from django.core.cache import cache
-from django.db.models import Min, Count, Sum
+from django.db.models import Count, Sum
 from django.template import Library
 from django.template.defaultfilters import stringfilter
-from django.utils.timezone import now
 from django.utils.translation import gettext as _
 
 from nnmware.apps.address.models import City
 from nnmware.apps.booking.models import Hotel, TWO_STAR, THREE_STAR, FOUR_STAR, FIVE_STAR, HotelOption, MINI_HOTEL, \
-    PlacePrice, Availability, HOSTEL, APARTAMENTS, SettlementVariant, Room, RoomDiscount, STATUS_CHOICES
-from nnmware.apps.money.models import ExchangeRate, Currency
-from nnmware.core.maps import distance_to_object
+    PlacePrice, Availability, HOSTEL, APARTAMENTS, SettlementVariant, RoomDiscount, STATUS_CHOICES
+from nnmware.apps.booking.quotes import request_quotes
+from nnmware.apps.booking.searchcache import get_cached_search, path_search_key
+from nnmware.apps.money.exchange import convert_amount, request_rate
+from nnmware.core.maps import distance_to_object, distances_to_objects
 from nnmware.core.utils import convert_to_date, setting
 
 register = Library()
 
 
+def search_result(context):
+    """ Pk's of hotels found by search on current page, if it is cached """
+    key = context.get('search_key') or path_search_key(context['request'].get_full_path())
+    return get_cached_search(key)
+
+
 @register.simple_tag(takes_context=True)
 def search_sticky_options(context):
-    request = context['request']
-    key = sha1(request.get_full_path(),).hexdigest()
-    data_key = cache.get(key)
+    facets = context.get('facets')
+    data_key = None if facets is not None else search_result(context)
     result = HotelOption.objects.filter(in_search=True, sticky_in_search=True)
-    if data_key:
+    if facets is not None:
+        result = result.filter(pk__in=[option for option, count in facets.options.items() if count])
+    elif data_key:
         hotels = Hotel.objects.filter(pk__in=data_key)
         result = result.filter(hotel__in=hotels).distinct()
     return result.order_by('position')
@@ -35,11 +41,12 @@ def search_sticky_options(context):
 
 @register.simple_tag(takes_context=True)
 def search_options(context):
-    request = context['request']
-    key = sha1(request.get_full_path(),).hexdigest()
-    data_key = cache.get(key)
+    facets = context.get('facets')
+    data_key = None if facets is not None else search_result(context)
     result = HotelOption.objects.filter(in_search=True, sticky_in_search=False)
-    if data_key:
+    if facets is not None:
+        result = result.filter(pk__in=[option for option, count in facets.options.items() if count])
+    elif data_key:
         hotels = Hotel.objects.filter(pk__in=data_key)
         result = result.filter(hotel__in=hotels).distinct()
     return result.order_by('position')
@@ -175,117 +182,41 @@ def dates_guests_from_context(context):
     return from_date, to_date, date_period, delta, guests
 
 
+def quotes_from_context(context, hotel_id, rate):
+    from_date, to_date, date_period, delta, guests = dates_guests_from_context(context)
+    engine = request_quotes(context['request'], from_date, to_date, guests, rate)
+    if not engine.has_hotel(hotel_id):
+        # Quote all hotels of current page at once
+        hotels = [h.pk for h in context.get('object_list') or [] if isinstance(h, Hotel)]
+        engine.load(hotels + [hotel_id])
+    return engine
+
+
 @register.simple_tag(takes_context=True)
 def room_price_average(context, room, rate):
-    from_date, to_date, date_period, delta, guests = dates_guests_from_context(context)
-    s = room.settlement_on_date_for_guests(from_date, guests)
-    all_sum = PlacePrice.objects.filter(settlement__room=room, settlement__settlement=s, date__range=date_period).\
-        aggregate(Sum('amount'))
-    room_sum = all_sum['amount__sum']
-    result = room_sum / delta
-    return convert_to_client_currency(result, rate)
+    quote = quotes_from_context(context, room.hotel_id, rate).quote(room)
+    if quote is None:
+        return None
+    return quote.average
 
 
 @register.simple_tag(takes_context=True)
 def room_full_amount(context, room, rate):
-    from_date, to_date, date_period, delta, guests = dates_guests_from_context(context)
-    settlement = SettlementVariant.objects.filter(room=room, settlement__gte=guests,
-        placeprice__date__range=date_period, placeprice__amount__gt=0).annotate(valid_s=Count('pk')).\
-        filter(valid_s__gte=delta).order_by('settlement').values_list('pk', flat=True).distinct()[0]
-    result = PlacePrice.objects.filter(settlement__room=room, settlement__pk=settlement,
-                                       date__range=date_period).aggregate(Sum('amount'))['amount__sum']
-    return convert_to_client_currency(result, rate)
+    quote = quotes_from_context(context, room.hotel_id, rate).quote(room)
+    if quote is None:
+        return None
+    return quote.amount
 
 
 @register.simple_tag(takes_context=True)
 def price_variants(context, room, rate):
     btype = context.get('btype')
-    from_date, to_date, date_period, delta, guests = dates_guests_from_context(context)
-    settlement = SettlementVariant.objects.filter(room=room, settlement__gte=guests,
-        placeprice__date__range=date_period, placeprice__amount__gt=0).annotate(valid_s=Count('pk')).\
-        filter(valid_s__gte=delta).order_by('settlement').values_list('pk', flat=True).distinct()[0]
-    result = PlacePrice.objects.filter(settlement__room=room, settlement__pk=settlement,
-                                       date__range=date_period).aggregate(Sum('amount'))['amount__sum']
-    answer = convert_to_client_currency(result, rate)
-    total_cost = answer
-    discount = room.simple_discount
-    prices = []
-    ub, gb, nr = dict(), dict(), dict()
-    variants = []
-    if discount.ub:
-        if 0 < discount.ub_discount < 100:
-            ub['price'] = (answer * (100 - discount.ub_discount)) / 100
-            ub['discount'] = discount.ub_discount
-        else:
-            ub['price'] = answer
-            ub['discount'] = None
-        ub['average'] = ub['price'] / delta
-        ub['variant'] = 'ub'
-        if btype == 'ub':
-            total_cost = ub['price']
-    if discount.gb:
-        gb['days'] = from_date - timedelta(days=discount.gb_days)
-        if 0 < discount.gb_discount < 100:
-            gb['price'] = (answer * (100 - discount.gb_discount)) / 100
-            gb['discount'] = discount.gb_discount
-        else:
-            gb['price'] = answer
-            gb['discount'] = None
-        if 0 < discount.gb_penalty <= 100:
-            room_answer = PlacePrice.objects.get(settlement__room=room, settlement__pk=settlement, date=from_date)
-            room_answer = convert_to_client_currency(room_answer.amount, rate)
-            if gb['discount'] is not None:
-                gb['penalty'] = (room_answer * (100 - gb['discount']) * discount.gb_penalty) / 10000
-            else:
-                gb['penalty'] = (room_answer * discount.gb_penalty) / 100
-        else:
-            gb['penalty'] = None
-        gb['average'] = gb['price'] / delta
-        gb['variant'] = 'gb'
-        if btype == 'gb':
-            total_cost = gb['price']
-    if discount.nr:
-        if 0 < discount.nr_discount < 100:
-            nr['price'] = (answer * (100 - discount.nr_discount)) / 100
-            nr['discount'] = discount.nr_discount
-        else:
-            nr['price'] = answer
-            nr['discount'] = None
-        if btype == 'nr':
-            total_cost = nr['price']
-        nr['average'] = nr['price'] / delta
-        nr['variant'] = 'nr'
-    if btype == 'ub' and bool(ub):
-        variants.append(ub)
-        if bool(gb):
-            variants.append(gb)
-        if bool(nr):
-            variants.append(nr)
-    elif btype == 'gb' and bool(gb):
-        variants.append(gb)
-        if bool(ub):
-            variants.append(ub)
-        if bool(nr):
-            variants.append(nr)
-    elif btype == 'nr' and bool(nr):
-        variants.append(nr)
-        if bool(ub):
-            variants.append(ub)
-        if bool(gb):
-            variants.append(gb)
-    else:
-        if bool(ub):
-            variants.append(ub)
-        if bool(gb):
-            variants.append(gb)
-        if bool(nr):
-            variants.append(nr)
-    prices.append(variants)
-    prices.append(answer / delta)
-    prices.append(total_cost)
-    prices.append(delta)
-    prices.append(len(variants))
-    return prices
+    engine = quotes_from_context(context, room.hotel_id, rate)
+    quote = engine.quote(room)
+    if quote is None:
+        return [[], 0, 0, engine.delta, 0]
+    variants = quote.variants(btype)
+    return [variants, quote.amount / engine.delta, quote.total_cost(btype), engine.delta, len(variants)]
 
 
 @register.simple_tag(takes_context=True)
@@ -349,40 +280,19 @@ def view_currency(context):
 
 @register.simple_tag
 def convert_to_client_currency(amount, rate):
-    try:
-        if setting('OFFICIAL_RATE', True):
-            exchange = rate.official_rate
-        else:
-            exchange = rate.rate
-        return int((amount * rate.nominal) / exchange)
-    except:
-        return int(amount)
+    return convert_amount(amount, rate)
 
 
 def amount_request_currency(request, amount):
     try:
-        currency = Currency.objects.get(code=request.COOKIES['currency'])
-        rate = ExchangeRate.objects.filter(currency=currency).filter(date__lte=now()).order_by('-date')[0]
-        if setting('OFFICIAL_RATE', True):
-            exchange = rate.official_rate
-        else:
-            exchange = rate.rate
-        return int((amount * rate.nominal) / exchange)
-    except:
+        rate = request_rate(request, request.COOKIES['currency'])
+    except KeyError as kerr:
         return int(amount)
+    return convert_amount(amount, rate)
 
 
 def user_rate_from_request(request):
-    try:
-        user_currency = request.COOKIES['currency']
-    except:
-        user_currency = setting('CURRENCY', 'RUB')
-    try:
-        rate = ExchangeRate.objects.select_related().filter(currency__code=user_currency).\
-            filter(date__lte=now()).order_by('-date')[0]
-        return rate
-    except:
-        return None
+    return request_rate(request)
 
 
 @register.simple_tag(takes_context=True)
@@ -397,6 +307,16 @@ def distance_for(origin, destiny):
     return format(result, '.2f')
 
 
+@register.simple_tag
+def distances_for(origin, destinies):
+    """
+    List of (destiny, distance) from origin to all destinies by one batch calculation, use as
+    {% distances_for hotel tourism_list as places %}{% for place, distance in places %}
+    """
+    destinies = list(destinies)
+    return [(d, format(km, '.2f')) for d, km in zip(destinies, distances_to_objects(origin, destinies))]
+
+
 @register.filter(is_safe=True)
 @stringfilter
 def rbtruncatechars(value, arg):
@@ -449,28 +369,59 @@ def make_values_by_dates(dates, array):
     return result
 
 
-@register.simple_tag
-def settlement_prices_on_dates(settlement, dates):
+def _grid_row(context, dates, room_id):
+    """ Row of room from rates_grid of cabinet, if grid is built for the same dates """
+    if dates is not context.get('dates'):
+        return None
+    for row in context.get('rates_grid') or ():
+        if row['room'].pk == room_id:
+            return row
+    return None
+
+
+def _grid_values(items, pk):
+    for obj, values in items:
+        if obj.pk == pk:
+            return values
+    return None
+
+
+@register.simple_tag(takes_context=True)
+def settlement_prices_on_dates(context, settlement, dates):
+    row = _grid_row(context, dates, settlement.room_id)
+    values = _grid_values(row['settlements'], settlement.pk) if row else None
+    if values is not None:
+        return values
     result = PlacePrice.objects.filter(settlement=settlement, date__in=dates).values_list('date', 'amount').\
         order_by('date')
     return make_values_by_dates(dates, result)
 
 
-@register.simple_tag
-def discount_on_dates(discount, room, dates):
+@register.simple_tag(takes_context=True)
+def discount_on_dates(context, discount, room, dates):
+    row = _grid_row(context, dates, room.pk)
+    values = _grid_values(row['discounts'], discount.pk) if row else None
+    if values is not None:
+        return values
     result = RoomDiscount.objects.filter(discount=discount, room=room, date__in=dates).values_list('date', 'value').\
         order_by('date')
     return make_values_by_dates(dates, result)
 
 
-@register.simple_tag
-def room_availability_on_dates(room, dates):
+@register.simple_tag(takes_context=True)
+def room_availability_on_dates(context, room, dates):
+    row = _grid_row(context, dates, room.pk)
+    if row:
+        return row['placecount']
     result = Availability.objects.filter(room=room, date__in=dates).values_list('date', 'placecount').order_by('date')
     return make_values_by_dates(dates, result)
 
 
-@register.simple_tag
-def room_min_days_on_dates(room, dates):
+@register.simple_tag(takes_context=True)
+def room_min_days_on_dates(context, room, dates):
+    row = _grid_row(context, dates, room.pk)
+    if row:
+        return row['min_days']
     result = Availability.objects.filter(room=room, date__in=dates).values_list('date', 'min_days').order_by('date')
     return make_values_by_dates(dates, result)
 
@@ -483,7 +434,6 @@ def room_avg_amount(amount, days):
 
 @register.simple_tag(takes_context=True)
 def stars_hotel_count(context):
-    request = context['request']
     # search_data = context['search_data']
     # try:
     #     on_date = convert_to_date(search_data['from_date']) - timedelta(days=1)
@@ -491,9 +441,10 @@ def stars_hotel_count(context):
     #     on_date = now()
     # hotels_with_amount = PlacePrice.objects.filter(date=on_date, amount__gt=0).\
     #     values_list('settlement__room__hotel__pk', flat=True).distinct()
+    if context.get('facets') is not None:
+        return context['facets'].stars_count()
     result = Hotel.objects.all()   # filter(pk__in=hotels_with_amount)
-    key = sha1('%s' % (request.get_full_path(),)).hexdigest()
-    data_key = cache.get(key)
+    data_key = search_result(context)
     if data_key:
         result = result.filter(pk__in=data_key).values('starcount').order_by('starcount').\
             annotate(Count('starcount'))
@@ -505,30 +456,12 @@ def stars_hotel_count(context):
 @register.simple_tag(takes_context=True)
 def min_search_hotel_price(context, hotel):
     user_rate = context['user_currency_rate']
-    from_date, to_date, date_period, delta, guests = dates_guests_from_context(context)
-    rooms = Room.objects.filter(hotel=hotel, availability__date__range=date_period,
-        availability__min_days__lte=delta, availability__placecount__gt=0).\
-        annotate(num_days=Count('pk')).filter(num_days__gte=delta).order_by('pk').values_list('pk', flat=True).\
-        distinct()
-    result = PlacePrice.objects.filter(settlement__room__in=rooms, settlement__settlement__gte=guests,
-         date=from_date, amount__gt=0).aggregate(Min('amount'))
-    return convert_to_client_currency(int(result['amount__min']), user_rate)
+    return quotes_from_context(context, hotel.pk, user_rate).min_hotel_price(hotel.pk)
 
 
 @register.simple_tag(takes_context=True)
 def search_minimal_hotel_cost(context, hotel, rate):
-    from_date, to_date, date_period, delta, guests = dates_guests_from_context(context)
-    rooms = hotel.available_rooms_for_guests_in_period(guests, from_date, to_date)
-    result = []
-    for room in rooms:
-        room_res = []
-        prices = price_variants(context, room, rate)[0]
-        if bool(prices):
-            for i in prices:
-                room_res.append(i['price'])
-        if bool(room_res):
-            result.append(min(room_res))
-    return min(result)
+    return quotes_from_context(context, hotel.pk, rate).min_hotel_cost(hotel.pk)
 
 
 @register.simple_tag
@@ -0,0 +1,65 @@
+# nnmware(c)2012-2020
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.db import connection
+from django.test import TransactionTestCase
+
+from .inventory import RoomSoldOut, reserve_room, stay_nights
+from .models import Room, Availability
+
+
+class ReserveRoomTestCase(TransactionTestCase):
+    def setUp(self):
+        # slug is set, so AbstractName.save makes only one insert
+        self.room = Room.objects.create(name="test", slug="test")
+        self.from_date = date(2030, 1, 1)
+        self.to_date = self.from_date + timedelta(days=3)
+        for night in stay_nights(self.from_date, self.to_date):
+            Availability.objects.create(room=self.room, date=night, placecount=5)
+
+    @unittest.skipUnless(connection.features.has_select_for_update, "Database has no row locks")
+    def test_concurrent_reservations(self):
+        """ Parallel reservations take not more places than free """
+        def book(i):
+            try:
+                reserve_room(self.room, self.from_date, self.to_date)
+                return True
+            except RoomSoldOut:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            booked = sum(pool.map(book, range(30)))
+        self.assertEqual(booked, 5)
+        self.assertEqual(set(Availability.objects.filter(room=self.room).values_list('placecount', flat=True)), {0})
+
+    def test_sequential_reservations(self):
+        """ Reservations after last free place is sold out and places never go below zero """
+        booked = 0
+        for i in range(8):
+            try:
+                reserve_room(self.room, self.from_date, self.to_date)
+                booked += 1
+            except RoomSoldOut:
+                pass
+        self.assertEqual(booked, 5)
+        self.assertEqual(set(Availability.objects.filter(room=self.room).values_list('placecount', flat=True)), {0})
+
+    def test_duplicated_night(self):
+        """ Duplicated row of night is not counted as sold out and only one row is taken """
+        Availability.objects.create(room=self.room, date=self.from_date, placecount=5)
+        reserve_room(self.room, self.from_date, self.to_date)
+        placecounts = Availability.objects.filter(room=self.room, date=self.from_date).values_list('placecount',
+                                                                                                  flat=True)
+        self.assertEqual(sorted(placecounts), [4, 5])
+
+    def test_sold_out(self):
+        """ Night without free places makes all stay sold out and nothing is changed """
+        Availability.objects.filter(room=self.room, date=self.from_date + timedelta(days=1)).update(placecount=0)
+        with self.assertRaises(RoomSoldOut):
+            reserve_room(self.room, self.from_date, self.to_date)
+        self.assertEqual(Availability.objects.filter(room=self.room, placecount=5).count(), 2)
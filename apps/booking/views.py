@@ -4,15 +4,12 @@ from __future__ import unicode_literals
 
 from datetime import timedelta
 from decimal import Decimal
-from functools import reduce
-from hashlib import sha1
-from operator import and_
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
-from django.db.models import Count, Sum, Max, F, Min, Q
-from django.http import Http404
+from django.db import transaction
+from django.db.models import Count, Sum, Max, F, Q
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.utils.decorators import method_decorator
@@ -27,14 +24,25 @@ from django.views.generic.list import ListView
 
 from nnmware.apps.address.models import City
 from nnmware.apps.booking.ajax import CardError
+from nnmware.apps.booking.demand import log_search
+from nnmware.apps.booking.facets import hotel_facets
 from nnmware.apps.booking.forms import CabinetInfoForm, CabinetRoomForm, \
     CabinetEditBillForm, RequestAddHotelForm, UserCabinetInfoForm, BookingAddForm
 from nnmware.apps.booking.models import Hotel, Room, RoomOption, SettlementVariant, Availability, PlacePrice, \
     STATUS_ACCEPTED, HotelOption, Booking, RequestAddHotel, BOOKING_GB, BOOKING_NR, BOOKING_UB, \
-    HotelSearch
-from nnmware.apps.booking.templatetags.booking_tags import convert_to_client_currency, user_rate_from_request
+    HotelSearch, SearchDemand
+from nnmware.apps.booking.inventory import RoomSoldOut, reserve_room, stay_prices
+from nnmware.apps.booking.rates import rates_grid, refresh_hotel_amounts
+from nnmware.apps.booking.ratesfile import RATES_FORMATS, export_rates_rows, csv_stream, xlsx_stream, \
+    read_rates_rows, import_rates
+from nnmware.apps.booking.reports import SNAPSHOT_REPORTS, REPORT_NAMES, SnapshotList, report_snapshot, \
+    refresh_report_snapshot
+from nnmware.apps.booking.search import calendar_hotels, refresh_room_calendar, refresh_price_summary, \
+    price_summary_hotels
+from nnmware.apps.booking.searchcache import search_key, path_search_key, cached_search
 from nnmware.apps.booking.utils import booking_new_client_mail
 from nnmware.apps.booking.utils import guests_from_request, booking_new_sysadm_mail, request_add_hotel_mail
+from nnmware.apps.money.exchange import convert_many, user_currency
 from nnmware.apps.money.models import Bill, Currency, BILL_UNKNOWN
 from nnmware.core.ajax import ajax_answer_lazy
 from nnmware.core.decorators import ssl_required
@@ -143,9 +151,10 @@ class HotelList(AjaxViewMixin, RedirectHttpView, ListView):
         return super(HotelList, self).get(request, *args, **kwargs)
 
     def get_queryset(self):
-        key = sha1('%s' % (self.request.get_full_path(),)).hexdigest()
         searched_date = False
         self.search_data = dict()
+        self.search_key = None
+        self.facets = None
         order = self.request.GET.get('order') or None
         sort = self.request.GET.get('sort') or None
         guests = guests_from_request(self.request)
@@ -173,21 +182,7 @@ class HotelList(AjaxViewMixin, RedirectHttpView, ListView):
                         from_date, to_date = to_date, from_date
                     else:
                         self.search_data = {'from_date': f_date, 'to_date': t_date, 'guests': guests}
-                    try:
-                        h_s = HotelSearch()
-                        h_s.date = now()
-                        h_s.from_date = from_date
-                        h_s.to_date = to_date
-                        if guests:
-                            h_s.guests = guests
-                        if self.request.user.is_authenticated:
-                            h_s.user = self.request.user
-                        h_s.user_agent = self.request.META.get('HTTP_USER_AGENT', '')[:255]
-                        h_s.ip = self.request.META.get('REMOTE_ADDR', '')
-                        h_s.city = self.kwargs['slug']
-                        h_s.save()
-                    except:
-                        pass
+                    log_search(self.request, from_date, to_date, guests, self.kwargs['slug'])
                     self.search_data['city'] = self.city
                     if stars:
                         self.search_data['stars'] = stars
@@ -200,18 +195,26 @@ class HotelList(AjaxViewMixin, RedirectHttpView, ListView):
                 except:
                     pass
             self.search = 1
+        if searched_date:
+            key = search_key(self.city, from_date, to_date, guests)
+        else:
+            key = search_key(self.city)
         self.result_count = None
         if self.request.is_ajax():
             self.template_name = "hotels/list_ajax.html"
             path = self.request.POST.get('path') or None
             if path:
-                key = sha1('%s' % (path,)).hexdigest()
-        data_key = cache.get(key)
-        if not data_key:
+                key = path_search_key(path)
+
+        def find_hotels():
             search_hotel = Hotel.objects.select_related('city').exclude(payment_method=None)
             if self.city:
                 search_hotel = search_hotel.filter(Q(city=self.city) | Q(addon_city=self.city))
-            if searched_date:
+            if searched_date and setting('BOOKING_CALENDAR_SEARCH', True):
+                # One range scan over precomputed bookable nights
+                searched_hotels_list = calendar_hotels(from_date, to_date, guests, self.city)
+                search_hotel = search_hotel.filter(pk__in=list(searched_hotels_list), work_on_request=False)
+            elif searched_date:
                 # Find all rooms pk for this guest count
                 need_days = (to_date - from_date).days
                 date_period = (from_date, to_date - timedelta(days=1))
@@ -232,42 +235,27 @@ class HotelList(AjaxViewMixin, RedirectHttpView, ListView):
                     values_list('hotel__pk', flat=True).distinct()
                 search_hotel = search_hotel.filter(pk__in=list(searched_hotels_list), work_on_request=False).\
                     exclude(pk__in=list(searched_hotels_not_avail))
-            hotels_pk_list = search_hotel.values_list('pk', flat=True).distinct()
-            cache.set(key, hotels_pk_list, 300)
-        else:
-            search_hotel = Hotel.objects.select_related('city').filter(pk__in=data_key)
+            return list(search_hotel.values_list('pk', flat=True).distinct())
+
+        self.search_key = key
+        hotels_with_amount = None
         if with_amount and amount_max and amount_min:
             self.search_data['amount'] = [amount_min, amount_max]
-            if searched_date:
-                hotels_with_amount = PlacePrice.objects.filter(date=from_date,
-                    amount__range=(amount_min, amount_max)).values_list('settlement__room__hotel__pk',
-                    flat=True).distinct()
-            else:
-                hotels_with_amount = PlacePrice.objects.filter(date=now(),
-                    amount__range=(amount_min, amount_max)).values_list('settlement__room__hotel__pk',
-                    flat=True).distinct()
-            search_hotel = search_hotel.filter(pk__in=hotels_with_amount)
-        if options:
-            search_hotel = search_hotel.filter(reduce(and_, [Q(option=option) for option in options]))
-        if stars:
-            search_hotel = search_hotel.filter(starcount__in=stars)
+            hotels_with_amount = set(price_summary_hotels(from_date if searched_date else now(), amount_min,
+                                                          amount_max))
+        # counts for filters of sidebar and filtered hotels by one pass over summaries of found hotels
+        self.facets = hotel_facets(cached_search(key, find_hotels), stars, options, hotels_with_amount)
+        search_hotel = Hotel.objects.select_related('city').filter(pk__in=self.facets.hotels)
         if order:
             self.tab, ui_order = hotel_order(self.tab, order, sort)
             search_hotel = search_hotel.order_by(ui_order)
         if not f_date and not t_date:
             self.search_data = default_search()
         result = search_hotel.annotate(Count('review'))
-        self.result_count = result.count()
-        if result:  # and self.request.is_ajax():
-            amounts = PlacePrice.objects.filter(date__gte=now(), amount__gt=0,
-                settlement__room__hotel__in=result).aggregate(Min('amount'), Max('amount'))
-            if not amounts['amount__min']:
-                amounts['amount__min'] = 0
-            if not amounts['amount__max']:
-                amounts['amount__max'] = 0
-            rate = user_rate_from_request(self.request)
-            self.payload['amount_min'] = convert_to_client_currency(int(amounts['amount__min']), rate)
-            self.payload['amount_max'] = convert_to_client_currency(int(amounts['amount__max']), rate)
+        self.result_count = len(self.facets.hotels)
+        if self.result_count:  # and self.request.is_ajax():
+            self.payload['amount_min'], self.payload['amount_max'] = convert_many(
+                [int(self.facets.amount_min), int(self.facets.amount_max)], user_currency(self.request))
         self.payload['result_count'] = self.result_count
         return result
 
@@ -277,6 +265,8 @@ class HotelList(AjaxViewMixin, RedirectHttpView, ListView):
         context['title_line'] = _('list of hotels')
         context['tab'] = self.tab
         context['path'] = self.request.get_full_path()
+        context['search_key'] = self.search_key
+        context['facets'] = self.facets
         if self.search:
             context['search'] = self.search
             context['city'] = self.city
@@ -352,22 +342,7 @@ class HotelDetail(AjaxViewMixin, HotelPathMixin, AttachedImagesMixin, DetailView
             if from_date > to_date:
                 from_date, to_date = to_date, from_date
                 f_date, t_date = t_date, f_date
-            try:
-                h_s = HotelSearch()
-                h_s.date = now()
-                h_s.from_date = from_date
-                h_s.to_date = to_date
-                if guests:
-                    h_s.guests = guests
-                if self.request.user.is_authenticated:
-                    h_s.user = self.request.user
-                h_s.user_agent = self.request.META.get('HTTP_USER_AGENT', '')[:255]
-                h_s.ip = self.request.META.get('REMOTE_ADDR', '')
-                h_s.city = self.kwargs['city']
-                h_s.hotel = self.kwargs['slug']
-                h_s.save()
-            except:
-                pass
+            log_search(self.request, from_date, to_date, guests, self.kwargs['city'], self.kwargs['slug'])
             need_days = (to_date - from_date).days
             if (from_date - now()).days < -1:
                 rooms = []
@@ -459,22 +434,7 @@ class RoomDetail(AttachedImagesMixin, DetailView):
             if from_date > to_date:
                 from_date, to_date = to_date, from_date
                 f_date, t_date = t_date, f_date
-            try:
-                h_s = HotelSearch()
-                h_s.date = now()
-                h_s.from_date = from_date
-                h_s.to_date = to_date
-                if guests:
-                    h_s.guests = guests
-                if self.request.user.is_authenticated:
-                    h_s.user = self.request.user
-                h_s.user_agent = self.request.META.get('HTTP_USER_AGENT', '')[:255]
-                h_s.ip = self.request.META.get('REMOTE_ADDR', '')
-                h_s.city = self.kwargs['city']
-                h_s.hotel = self.kwargs['slug']
-                h_s.save()
-            except:
-                pass
+            log_search(self.request, from_date, to_date, guests, self.kwargs['city'], self.kwargs['slug'])
             need_days = (to_date - from_date).days
             if (from_date - now()).days < -1:
                 search_data = default_search()
@@ -581,6 +541,12 @@ class CabinetEditRoom(UpdateView, CurrentUserRoomAdmin):
                 settlement.save()
             except:
                 SettlementVariant(room=self.object, settlement=variant, enabled=True).save()
+        last_date = PlacePrice.objects.filter(settlement__room=self.object, date__gte=now()).\
+            aggregate(Max('date'))['date__max']
+        if last_date:
+            refresh_room_calendar([self.object], now(), last_date)
+            refresh_price_summary([self.object.hotel_id], now(), last_date)
+        refresh_hotel_amounts([self.object.hotel_id])
         return super(CabinetEditRoom, self).form_valid(form)
 
 
@@ -636,11 +602,55 @@ class CabinetRates(HotelPathMixin, DetailView, CurrentUserHotelAdmin):
             else:
                 date_period.append(i)
         context['dates'] = date_period
+        context['rates_grid'] = rates_grid(self.object, context['rooms'], date_period)
         context['days_of_week'] = days_of_week
         context['sheet_lst'] = self.request.POST.getlist('sheet') or True
         return context
 
 
+class CabinetRatesExport(HotelPathMixin, CurrentUserHotelAdmin):
+    """ Download of prices and availability of hotel as csv or xlsx, rows is streamed """
+
+    def get(self, request, *args, **kwargs):
+        file_format = request.GET.get('format') or 'csv'
+        if file_format not in RATES_FORMATS:
+            raise Http404
+        try:
+            from_date = convert_to_date(request.GET['from']).date()
+        except (KeyError, ValueError):
+            from_date = None
+        try:
+            to_date = convert_to_date(request.GET['to']).date()
+        except (KeyError, ValueError):
+            to_date = None
+        rows = export_rates_rows(self.object, from_date, to_date)
+        if file_format == 'xlsx':
+            response = StreamingHttpResponse(xlsx_stream(rows), content_type='application/vnd.openxmlformats-'
+                                                                             'officedocument.spreadsheetml.sheet')
+        else:
+            response = StreamingHttpResponse(csv_stream(rows), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment;filename="rates_%s.%s"' % (self.object.pk, file_format)
+        return response
+
+
+class CabinetRatesImport(HotelPathMixin, CurrentUserHotelAdmin):
+    """ Upload of prices and availability of hotel from csv or xlsx, answer is summary of changes """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            upload = request.FILES['rates_file']
+            file_format = upload.name.rsplit('.', 1)[-1].lower()
+            if file_format not in RATES_FORMATS:
+                raise ValueError
+            currency = Currency.objects.get(code=setting('DEFAULT_CURRENCY', 'RUB'))
+        except (KeyError, ValueError, Currency.DoesNotExist) as err:
+            return ajax_answer_lazy(dict(success=False))
+        # import is not atomic, on error answer has counts of cells saved before it
+        result = import_rates(self.object, read_rates_rows(upload, file_format), currency)
+        payload = dict(success=result['error'] is None, **result)
+        return ajax_answer_lazy(payload)
+
+
 class CabinetDiscount(HotelPathMixin, DetailView, CurrentUserHotelAdmin):
     model = Hotel
     template_name = "cabinet/discounts.html"
@@ -837,6 +847,7 @@ class ReportView(ListView, CurrentUserSuperuser):
     def get_queryset(self):
         report_type = self.kwargs['slug'] or None
         self.report_name = _('Error')
+        self.snapshot = None
         result = None
         if report_type == 'all':
             result = Hotel.objects.select_related().all()
@@ -856,36 +867,12 @@ class ReportView(ListView, CurrentUserSuperuser):
         elif report_type == 'onrequest':
             result = Hotel.objects.select_related().filter(work_on_request=True)
             self.report_name = _('Hotels, works on request')
-        elif report_type == 'non-correct':
-            not_filled_room = Room.objects.filter(availability__date__range=(now(),
-                now() + timedelta(days=13))).annotate(num_days=Count('pk')).filter(num_days__lt=14).\
-                order_by('hotel').values_list('hotel__pk', flat=True).distinct()
-            empty_avail_info = Room.objects.exclude(hotel__work_on_request=True).exclude(availability__date__range=
-                (now(), now() + timedelta(days=13))).order_by('hotel').values_list('hotel__pk', flat=True).distinct()
-            not_filled_amount = SettlementVariant.objects.exclude(placeprice__amount=0).\
-                filter(enabled=True, placeprice__date__range=(now(),
-                now() + timedelta(days=13))).annotate(num_days=Count('placeprice__pk')).\
-                filter(num_days__lt=14).order_by('room__hotel').values_list('room__hotel__pk', flat=True).distinct()
-            result = Hotel.objects.select_related().exclude(admins=None).exclude(work_on_request=True).\
-                filter(Q(pk__in=not_filled_room) | Q(pk__in=not_filled_amount) | Q(pk__in=empty_avail_info))
-            self.report_name = _('Hotels, not fully entered info')
-        elif report_type == 'nullroom':
-            nullroom = Room.objects.filter(availability__date__range=(now(),
-                now() + timedelta(days=13)), availability__placecount=0).annotate(num_days=Count('pk')).\
-                filter(num_days=14).order_by('hotel').values_list('hotel__pk', flat=True).distinct()
-            result = Hotel.objects.select_related().exclude(admins=None).exclude(work_on_request=True).\
-                filter(pk__in=nullroom)
-            self.report_name = _('Hotels, which have null availability on 14 days')
-        elif report_type == 'nullpercent':
-            result = Hotel.objects.select_related().filter(agentpercent__date__lte=now()).\
-                annotate(Max('agentpercent__date')).filter(agentpercent__percent=0,
-                                                           agentpercent__date__max=F('agentpercent__date'))
-            self.report_name = _('Hotels, with current null percent')
-        elif report_type == 'city':
-            result = City.objects.extra(select={'h_count': """SELECT COUNT(*) FROM booking_hotel WHERE
-                (booking_hotel.enabled = 1 AND booking_hotel.city_id = address_city.id)"""}).order_by('name')
-            self.report_name = _('Total cities')
-            self.template_name = "sysadm/report_city.html"
+        elif report_type in SNAPSHOT_REPORTS:
+            self.snapshot = report_snapshot(report_type)
+            result = SnapshotList(self.snapshot)
+            self.report_name = REPORT_NAMES[report_type]
+            if report_type == 'city':
+                self.template_name = "sysadm/report_city.html"
         elif report_type == 'login':
             self.model = get_user_model()
             result = get_user_model().objects.annotate(Count('hotel')).filter(hotel__count__gt=0).\
@@ -903,15 +890,29 @@ class ReportView(ListView, CurrentUserSuperuser):
             result = HotelSearch.objects.select_related('user').order_by('-date')
             self.report_name = _('Searched parameters')
             self.template_name = "sysadm/report_searched.html"
-        if report_type not in ['city', 'login', 'nologin', 'searched'] and result:
+        elif report_type == 'demand':
+            self.model = SearchDemand
+            result = SearchDemand.objects.filter(date__gte=now()).order_by('-searches')
+            self.report_name = _('Search demand per city, check-in date and guests')
+            self.template_name = "sysadm/report_demand.html"
+        if report_type not in ['city', 'login', 'nologin', 'searched', 'demand'] + list(SNAPSHOT_REPORTS) and result:
             result = result.order_by('city__name', 'name')
         self.report_arg = report_type
         if result:
-            self.full_count = result.count()
+            self.full_count = len(result) if self.snapshot else result.count()
         else:
             self.full_count = 0
         return result
 
+    def post(self, request, *args, **kwargs):
+        # CurrentUserSuperuser is after ListView in mro, so its dispatch is not called
+        if not request.user.is_superuser:
+            raise Http404
+        # refresh snapshot of report on demand
+        if kwargs.get('slug') in SNAPSHOT_REPORTS:
+            refresh_report_snapshot(kwargs['slug'])
+        return HttpResponseRedirect(request.get_full_path())
+
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
         context = super(ReportView, self).get_context_data(**kwargs)
@@ -921,6 +922,9 @@ class ReportView(ListView, CurrentUserSuperuser):
         context['report_name'] = self.report_name
         context['report_name'] = self.report_name
         context['report_arg'] = self.report_arg
+        if self.snapshot:
+            context['snapshot_date'] = self.snapshot.created_date
+            context['snapshot_age'] = self.snapshot.age
         return context
 
 
@@ -1144,6 +1148,7 @@ class ClientAddBooking(UserToFormMixin, AjaxFormMixin, CreateView):
         discount = 0
         from_date = self.object.from_date
         to_date = self.object.to_date
+        prices = stay_prices(settlement, self.object.hotel, from_date, to_date)
         if btype == 'ub':
             booking_type = BOOKING_UB
             if 0 < room_discount.ub_discount < 100:
@@ -1153,7 +1158,7 @@ class ClientAddBooking(UserToFormMixin, AjaxFormMixin, CreateView):
             if 0 < room_discount.gb_discount < 100:
                 discount = room_discount.gb_discount
                 if 0 < room_discount.gb_penalty < 101:
-                    price_1day = PlacePrice.objects.get(settlement=settlement, date=from_date)
+                    price_1day = prices[0][1]
                     self.object.penaltycancel = (price_1day / 100) * room_discount.gb_penalty
                 if room_discount.gb_days > 0:
                     self.object.freecancel = room_discount.gb_days
@@ -1164,20 +1169,12 @@ class ClientAddBooking(UserToFormMixin, AjaxFormMixin, CreateView):
         all_amount = Decimal(0)
         amount_no_discount = Decimal(0)
         commission = Decimal(0)
-        on_date = from_date
-        while on_date < to_date:
-            price = PlacePrice.objects.get(settlement=settlement, date=on_date)
-            percent = self.object.hotel.get_percent_on_date(on_date)
-            day_price = price.amount
+        for on_date, day_price, percent in prices:
             amount_no_discount += day_price
             if discount > 0:
                 day_price = (day_price * (100 - discount)) / 100
             commission += (day_price * percent) / 100
             all_amount += day_price
-            avail = Availability.objects.get(room=room, date=on_date)
-            avail.placecount -= 1
-            avail.save()
-            on_date = on_date + timedelta(days=1)
         self.object.amount = all_amount
         self.object.amount_no_discount = amount_no_discount
         self.object.hotel_sum = all_amount - commission
@@ -1189,7 +1186,13 @@ class ClientAddBooking(UserToFormMixin, AjaxFormMixin, CreateView):
         self.object.btype = booking_type
         if discount > 0:
             self.object.bdiscount = discount
-        self.object.save()
+        try:
+            with transaction.atomic():
+                reserve_room(room, from_date, to_date)
+                self.object.save()
+        except RoomSoldOut as soldout:
+            return ajax_answer_lazy({'success': False, 'error': _('No free rooms on these dates.')})
+        refresh_room_calendar([room], from_date, to_date)
         self.success_url = self.object.get_client_url()
         if not settings.DEBUG:
             if self.request.user.is_authenticated:
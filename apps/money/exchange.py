@@ -0,0 +1,61 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+from django.utils.timezone import now
+
+from nnmware.apps.money.models import ExchangeRate
+from nnmware.core.timeline import TimelineCache
+from nnmware.core.utils import setting
+
+# History of rates per currency code
+exchange_rates = TimelineCache('exchange_rate', lambda code: [(r.date, r) for r in ExchangeRate.objects.
+                               select_related().filter(currency__code=code).order_by('date', 'pk')])
+
+
+def invalidate_rates():
+    """ Drop memoized rates in this process and in all others, which share cache """
+    exchange_rates.invalidate()
+
+
+def latest_rate(code):
+    """ Latest ExchangeRate of currency on today or None """
+    return exchange_rates.get(code).at(now())
+
+
+def user_currency(request):
+    try:
+        return request.COOKIES['currency']
+    except (KeyError, AttributeError):
+        return setting('CURRENCY', 'RUB')
+
+
+def request_rate(request, code=None):
+    """ Rate of currency (by default - currency of user) memoized for this request """
+    code = code or user_currency(request)
+    memo = getattr(request, '_exchange_rates', None)
+    if memo is None:
+        memo = dict()
+        setattr(request, '_exchange_rates', memo)
+    if code not in memo:
+        memo[code] = latest_rate(code)
+    return memo[code]
+
+
+def convert_amount(amount, rate):
+    """ Convert amount in default currency to currency of rate """
+    # noinspection PyBroadException
+    try:
+        if setting('OFFICIAL_RATE', True):
+            exchange = rate.official_rate
+        else:
+            exchange = rate.rate
+        return int((amount * rate.nominal) / exchange)
+    except:
+        return int(amount)
+
+
+def convert_many(amounts, code):
+    """ Convert list of amounts in default currency to currency with code by one rate lookup """
+    rate = latest_rate(code)
+    return [convert_amount(amount, rate) for amount in amounts]
@@ -7,6 +7,7 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import ugettext_lazy as _
 from django.db import models
+from django.db.models import signals
 from django.utils.timezone import now
 
 from nnmware.core.abstract import Doc, AbstractContent
@@ -47,6 +48,15 @@ class ExchangeRate(models.Model):
         return "%s :: %s :: %s :: %s" % (self.currency, self.date, self.official_rate, self.rate)
 
 
+def exchange_rate_changed(sender, instance, **kwargs):
+    from nnmware.apps.money.exchange import invalidate_rates
+    invalidate_rates()
+
+
+signals.post_save.connect(exchange_rate_changed, sender=ExchangeRate, dispatch_uid="nnmware_exchange_rate")
+signals.post_delete.connect(exchange_rate_changed, sender=ExchangeRate, dispatch_uid="nnmware_exchange_rate")
+
+
 class MoneyBase(models.Model):
     amount = models.DecimalField(verbose_name=_('Amount'), default=0, max_digits=22, decimal_places=5, db_index=True)
     currency = models.ForeignKey(Currency, verbose_name=_('Currency'), on_delete=models.SET_NULL, blank=True, null=True)
@@ -7,7 +7,7 @@ from django.utils.translation import ugettext_lazy as _
 
 from nnmware.core.abstract import Pic, Doc
 from nnmware.core.models import Nnmcomment, Tag, Action, Follow, Notice, Message, VisitorHit, Video, \
-    EmailValidation, FlatNnmcomment, Like, ContentBlock
+    EmailValidation, FlatNnmcomment, Like, ContentBlock, VisitorHitRollup
 
 
 class TypeBaseAdmin(admin.ModelAdmin):
@@ -107,6 +107,16 @@ class VisitorHitAdmin(admin.ModelAdmin):
     ordering = ('-date', 'user', 'ip')
 
 
+@admin.register(VisitorHitRollup)
+class VisitorHitRollupAdmin(admin.ModelAdmin):
+    readonly_fields = ('date', 'url', 'referer', 'hits')
+    list_display = ('date', 'url', 'referer', 'hits')
+    list_filter = ('date',)
+    search_fields = ('url', 'referer')
+    date_hierarchy = 'date'
+    ordering = ('-date', '-hits')
+
+
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     fieldsets = ((_('nnmware'), {'fields': [('name', 'slug')]}),)
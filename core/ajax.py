@@ -30,6 +30,7 @@ from nnmware.core.file import get_path_from_url
 from nnmware.core.http import LazyEncoder
 from nnmware.core.models import Video, Follow, Tag, Notice, Message, Nnmcomment, FlatNnmcomment, Like
 from nnmware.core.imgutil import remove_thumbnails, remove_file, make_thumbnail
+from nnmware.core.thumbnails import enqueue_thumbnails
 from nnmware.core.signals import notice, action
 from nnmware.core.utils import update_video_size, setting, get_date_directory
 
@@ -738,6 +739,15 @@ class AjaxUploader(object):
                     old_filename=filename, filename=self._filename)
 
 
+def pregenerate_thumbnails(img):
+    """
+    Put thumbnails of saved image field in queue, they is made by make_thumbnails command.
+    Called after model is saved, as uploaded file is moved from buffer on saving.
+    """
+    if img and setting('THUMBNAIL_PREGENERATE', True):
+        enqueue_thumbnails(img.url)
+
+
 def addon_file_uploader(request, **kwargs):
     uploader = AjaxUploader()
     result = uploader.handle_upload(request)
@@ -777,6 +787,7 @@ def addon_image_uploader(request, **kwargs):
                                 new.img.field.upload_to, new.img.path)
         new.size = os.path.getsize(fullpath)
         new.save()
+        pregenerate_thumbnails(new.img)
         # noinspection PyBroadException
         try:
             pics_count = dict(pics_count=new.content_object.pics_count)
@@ -883,6 +894,7 @@ def avatar_set(request):
             pass
         request.user.img.save(result['filename'], File(open(result['path'] + '/' + result['filename'], 'rb')))
         request.user.save()
+        pregenerate_thumbnails(request.user.img)
         # noinspection PyBroadException
         try:
             addons = dict(html=render_to_string('user/avatar.html', {'object': request.user}))
@@ -0,0 +1,153 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+import atexit
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from nnmware.core.utils import setting
+
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+
+# Every process publishes stats of its buffers in cache under own slot, see buffer_stats()
+STATS_SLOTS_KEY = 'core_bulk_buffer_slots'
+STATS_SLOT_KEY = 'core_bulk_buffer_slot_%s'
+
+
+class BulkBuffer(object):
+    """
+    In-process ring buffer of unsaved model instances. Instances is written with bulk_create
+    in chunks by background thread every `interval` seconds or when buffer is full.
+    If buffer overflows before flush - oldest or newest instances is dropped and counted.
+    Instances, which is saved, is counted as flushed even if on_flush fails, its failures is counted apart.
+    Counters of all processes is read by buffer_stats() (manage.py buffer_stats).
+    """
+
+    def __init__(self, model, size=1000, interval=5, overflow=DROP_OLDEST, batch_size=500, on_flush=None):
+        self.model = model
+        self.size = size
+        self.interval = interval
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self._reset()
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.added = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.errors = 0
+        self.callback_errors = 0
+        self.last_flush = None
+        self.last_latency = None
+        self.max_latency = 0
+        self._slot = None
+
+    def _ensure_thread(self):
+        if self._pid != os.getpid():
+            # forked worker - buffer and thread of parent is not our
+            self._reset()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='bulk-buffer-%s' % self.model.__name__)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def add(self, obj):
+        with self._lock:
+            self._ensure_thread()
+            if len(self._items) >= self.size:
+                self.dropped += 1
+                if self.overflow == DROP_NEWEST:
+                    return False
+                self._items.popleft()
+            self._items.append(obj)
+            self.added += 1
+            if len(self._items) >= self.batch_size:
+                self._wakeup.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+            self.publish()
+
+    def flush(self):
+        with self._lock:
+            items = list(self._items)
+            self._items.clear()
+        if not items:
+            return 0
+        start = time.time()
+        try:
+            # instances of several models (e.g. day buckets of hits) is saved by model
+            models = dict()
+            for obj in items:
+                models.setdefault(type(obj), []).append(obj)
+            for model, objs in models.items():
+                model.objects.bulk_create(objs, batch_size=self.batch_size)
+        except Exception as err:
+            self.errors += 1
+            self.dropped += len(items)
+            return 0
+        latency = time.time() - start
+        self.flushed += len(items)
+        self.last_flush = start
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        if self.on_flush is not None:
+            # noinspection PyBroadException
+            try:
+                self.on_flush(items)
+            except Exception as err:
+                self.callback_errors += 1
+        return len(items)
+
+    def stats(self):
+        return dict(pending=len(self._items), added=self.added, flushed=self.flushed, dropped=self.dropped,
+                    errors=self.errors, callback_errors=self.callback_errors, last_flush=self.last_flush,
+                    last_latency=self.last_latency, max_latency=self.max_latency)
+
+    def publish(self):
+        """ Put stats of this process in cache, they expire if process is stopped """
+        # noinspection PyBroadException
+        try:
+            if self._slot is None:
+                try:
+                    self._slot = cache.incr(STATS_SLOTS_KEY)
+                except ValueError as valerr:
+                    self._slot = 1
+                    cache.set(STATS_SLOTS_KEY, 1, None)
+            stats = dict(self.stats(), buffer=self.model._meta.label_lower, host=socket.gethostname(),
+                         pid=self._pid, published=time.time())
+            cache.set(STATS_SLOT_KEY % self._slot, stats, setting('BULK_BUFFER_STATS_TTL', 10 * self.interval))
+        except Exception as err:
+            # stats must not stop flushing
+            pass
+
+
+def buffer_stats():
+    """ Stats of buffers of all live processes, which share cache """
+    slots = cache.get(STATS_SLOTS_KEY) or 0
+    result = []
+    # slots of stopped processes is expired, stats is read by chunks
+    for first in range(1, slots + 1, 500):
+        result.extend(cache.get_many([STATS_SLOT_KEY % n for n in range(first, min(first + 500, slots + 1))]).
+                      values())
+    return sorted(result, key=lambda s: (s['buffer'], s['host'], s['pid']))
@@ -5,10 +5,9 @@ from datetime import datetime, date, time
 from io import StringIO
 
 from django.http import HttpResponse
-from django.utils.timezone import now
 
 from nnmware.core.utils import setting
-from nnmware.apps.money.models import ExchangeRate, Currency
+from nnmware.apps.money.exchange import request_rate
 
 
 def convert_from_client_currency(request, amount):
@@ -16,8 +15,7 @@ def convert_from_client_currency(request, amount):
     try:
         if request.COOKIES['currency'] == setting('CURRENCY', 'RUB'):
             return amount
-        currency = Currency.objects.get(code=request.COOKIES['currency'])
-        rate = ExchangeRate.objects.filter(currency=currency).filter(date__lte=now()).order_by('-date')[0]
+        rate = request_rate(request, request.COOKIES['currency'])
         if setting('OFFICIAL_RATE', True):
             exchange = rate.official_rate
         else:
@@ -0,0 +1,223 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+import time
+from math import cos, radians, floor
+
+from django.core.cache import cache
+from django.db.models import signals
+
+from nnmware.core.maps import distance, RADIUS
+from nnmware.core.utils import setting
+
+KM_PER_DEGREE = radians(1) * RADIUS
+GEO_INDEX_VERSION_KEY = 'core_geo_index_version_%s'
+GEO_INDEX_LOG_KEY = 'core_geo_index_changed_%s_%s'
+GEO_INDEX_LOG_SIZE = 1000
+
+# Process level indexes: model label -> (version, time of version check, GridIndex)
+_indexes = dict()
+
+
+def bounding_box(latitude, longitude, radius):
+    """ (min_lat, max_lat, min_lng, max_lng) of square around point, radius in km """
+    d_lat = radius / KM_PER_DEGREE
+    lat_cos = cos(radians(min(abs(latitude) + d_lat, 89.9)))
+    d_lng = min(radius / (KM_PER_DEGREE * lat_cos), 180)
+    return latitude - d_lat, latitude + d_lat, longitude - d_lng, longitude + d_lng
+
+
+def bbox_queryset(queryset, latitude, longitude, radius):
+    """ Rows of queryset in bounding box of radius, uses indexes of latitude and longitude """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius)
+    return queryset.filter(latitude__range=(min_lat, max_lat), longitude__range=(min_lng, max_lng))
+
+
+class GridIndex(object):
+    """
+    Points (latitude, longitude, pk) in cells of grid of `cell` degrees.
+    Radius and nearest queries look only at cells around point.
+    Index is not changed after building, moved() makes new index with changed points.
+    """
+
+    def __init__(self, points, cell=0.05):
+        self.cell = cell
+        self.cells = dict()
+        self.points = dict()
+        for pk, latitude, longitude in points:
+            self.cells.setdefault(self._cell(latitude, longitude), []).append((latitude, longitude, pk))
+            self.points[pk] = (latitude, longitude)
+        self._set_bounds()
+
+    def _set_bounds(self):
+        self.count = len(self.points)
+        rows = [i for i, j in self.cells] or [0]
+        cols = [j for i, j in self.cells] or [0]
+        self.bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def moved(self, changes):
+        """
+        New index with points of changes [(pk, latitude, longitude)] moved, point with latitude None
+        is removed. Lists of not changed cells is shared with this index.
+        """
+        index = GridIndex((), self.cell)
+        index.cells = dict(self.cells)
+        index.points = dict(self.points)
+        for pk, latitude, longitude in changes:
+            old = index.points.pop(pk, None)
+            if old is not None:
+                cell = self._cell(*old)
+                rest = [p for p in index.cells.get(cell, ()) if p[2] != pk]
+                if rest:
+                    index.cells[cell] = rest
+                else:
+                    index.cells.pop(cell, None)
+            if latitude is not None and longitude is not None:
+                cell = self._cell(latitude, longitude)
+                index.cells[cell] = index.cells.get(cell, []) + [(latitude, longitude, pk)]
+                index.points[pk] = (latitude, longitude)
+        index._set_bounds()
+        return index
+
+    def _cell(self, latitude, longitude):
+        return int(floor(latitude / self.cell)), int(floor(longitude / self.cell))
+
+    def _scan(self, cells, latitude, longitude):
+        origin = (latitude, longitude)
+        for cell in cells:
+            for lat, lng, pk in self.cells.get(cell, ()):
+                yield distance(origin, (lat, lng)), pk
+
+    def within(self, latitude, longitude, radius):
+        """ [(distance, pk)] of points not farther than radius km, nearest first """
+        min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius)
+        i1, j1 = self._cell(min_lat, min_lng)
+        i2, j2 = self._cell(max_lat, max_lng)
+        cells = ((i, j) for i in range(i1, i2 + 1) for j in range(j1, j2 + 1))
+        return sorted(d for d in self._scan(cells, latitude, longitude) if d[0] <= radius)
+
+    def in_box(self, min_lat, max_lat, min_lng, max_lng):
+        """ [(latitude, longitude, pk)] of points in box """
+        i1, j1 = self._cell(min_lat, min_lng)
+        i2, j2 = self._cell(max_lat, max_lng)
+        i1, i2 = max(i1, self.bounds[0]), min(i2, self.bounds[1])
+        j1, j2 = max(j1, self.bounds[2]), min(j2, self.bounds[3])
+        if i2 < i1 or j2 < j1:
+            return []
+        if (i2 - i1 + 1) * (j2 - j1 + 1) > len(self.cells):
+            # box is large in comparison with filled cells
+            cells = (points for (i, j), points in self.cells.items() if i1 <= i <= i2 and j1 <= j <= j2)
+        else:
+            cells = (self.cells.get((i, j), ()) for i in range(i1, i2 + 1) for j in range(j1, j2 + 1))
+        return [p for points in cells for p in points if min_lat <= p[0] < max_lat and min_lng <= p[1] < max_lng]
+
+    def nearest(self, latitude, longitude, k=1):
+        """
+        [(distance, pk)] of k nearest points, nearest first. Rings of cells is scanned while
+        they have less cells then index has points, farther all points is scanned at once.
+        """
+        ci, cj = self._cell(latitude, longitude)
+        found = []
+        # rings around cell of point until all cells with points is scanned
+        max_ring = max(ci - self.bounds[0], self.bounds[1] - ci, cj - self.bounds[2], self.bounds[3] - cj)
+        ring = 0
+        while ring <= max_ring:
+            if (2 * ring + 1) ** 2 > self.count:
+                # nearest points is far away, e.g. city without metro
+                origin = (latitude, longitude)
+                return sorted((distance(origin, p), pk) for pk, p in self.points.items())[:k]
+            if ring:
+                cells = [(ci + i, cj + j) for i in range(-ring, ring + 1) for j in (-ring, ring)] + \
+                        [(ci + i, cj + j) for i in (-ring, ring) for j in range(-ring + 1, ring)]
+            else:
+                cells = [(ci, cj)]
+            found.extend(self._scan(cells, latitude, longitude))
+            if len(found) >= k:
+                found.sort()
+                # points outside of scanned rings is not nearer then this
+                lat_cos = cos(radians(min(abs(latitude) + (ring + 1) * self.cell, 89.9)))
+                if found[k - 1][0] <= ring * self.cell * KM_PER_DEGREE * lat_cos:
+                    break
+            ring += 1
+        found.sort()
+        return found[:k]
+
+
+def geo_index_version(model):
+    return cache.get(GEO_INDEX_VERSION_KEY % model._meta.label_lower) or 0
+
+
+def _geo_changes(label, old, version):
+    """ [(pk, latitude, longitude)] changed after version old, None if index must be rebuilt """
+    if not 0 < version - old <= GEO_INDEX_LOG_SIZE:
+        return None
+    keys = [GEO_INDEX_LOG_KEY % (label, v) for v in range(old + 1, version + 1)]
+    logged = cache.get_many(keys)
+    if len(logged) < len(keys):
+        # log is expired
+        return None
+    return [logged[key] for key in keys]
+
+
+def geo_index(model):
+    """
+    GridIndex of all rows of model. Rows changed in other processes is moved in index by log of changes,
+    index is rebuilt only if log is expired.
+    """
+    label = model._meta.label_lower
+    memo = _indexes.get(label)
+    if memo is not None and time.time() - memo[1] < setting('GEO_INDEX_CHECK', 10):
+        return memo[2]
+    version = geo_index_version(model)
+    changes = None if memo is None else _geo_changes(label, memo[0], version)
+    if changes is not None:
+        index = memo[2].moved(changes) if changes else memo[2]
+    else:
+        index = GridIndex(model.objects.values_list('pk', 'latitude', 'longitude'),
+                          setting('GEO_INDEX_CELL', 0.05))
+    _indexes[label] = (version, time.time(), index)
+    return index
+
+
+def geo_changed(sender, instance, **kwargs):
+    """
+    Signal handler for models with latitude and longitude. Nothing is done if point of row is not moved,
+    else row is moved in index of this process and change is logged for other processes.
+    """
+    label = sender._meta.label_lower
+    if kwargs.get('signal') is signals.post_delete:
+        change = (instance.pk, None, None)
+    else:
+        change = (instance.pk, float(instance.latitude), float(instance.longitude))
+    memo = _indexes.get(label)
+    if memo is not None and memo[2].points.get(instance.pk) == change[1:]:
+        return
+    key = GEO_INDEX_VERSION_KEY % label
+    try:
+        version = cache.incr(key)
+    except ValueError as valerr:
+        version = 1
+        cache.set(key, version, None)
+    cache.set(GEO_INDEX_LOG_KEY % (label, version), change, setting('GEO_INDEX_LOG_TTL', 3600))
+    if memo is not None:
+        index = memo[2].moved([change])
+        if memo[0] == version - 1:
+            _indexes[label] = (version, memo[1], index)
+        else:
+            # changes of other processes is read on next check
+            _indexes[label] = (memo[0], 0, index)
+
+
+def places_within(model, origin, radius):
+    """ [(distance, pk)] of rows of model not farther than radius km from origin, nearest first """
+    if setting('GEO_INDEX', True):
+        return geo_index(model).within(origin.latitude, origin.longitude, radius)
+    points = bbox_queryset(model.objects.all(), origin.latitude, origin.longitude, radius).\
+        values_list('pk', 'latitude', 'longitude')
+    return GridIndex(points).within(origin.latitude, origin.longitude, radius)
+
+
+def places_nearest(model, origin, k=1):
+    """ [(distance, pk)] of k rows of model nearest to origin """
+    return geo_index(model).nearest(origin.latitude, origin.longitude, k)
@@ -0,0 +1,111 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+import time
+from collections import Counter
+from datetime import datetime
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, models, transaction, DatabaseError
+from django.db.models import Count
+from django.utils.translation import ugettext_lazy as _
+
+from nnmware.core.models import AbstractVisitorHit, VisitorHitRollup
+
+# Day buckets of visitor hits - one table per day, expired bucket is dropped at once
+BUCKET_PREFIX = 'core_visitorhit_'
+
+_buckets = dict()
+_tables = set()
+# table -> time of check, when table was not found
+_missing = dict()
+
+
+def bucket_table(day):
+    return BUCKET_PREFIX + day.strftime('%Y%m%d')
+
+
+def hit_bucket_model(day):
+    """ Model of visitor hits bucket for day """
+    model = _buckets.get(day)
+    if model is None:
+        meta = type(str('Meta'), (object,), dict(db_table=bucket_table(day), app_label='core', ordering=['-date']))
+        # buckets is not known to deletion of users: no cascade to dropped tables and no constraint
+        user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('User'), blank=True, null=True,
+                                 on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+        model = type(str('VisitorHit%s' % day.strftime('%Y%m%d')), (AbstractVisitorHit,),
+                     dict(Meta=meta, user=user, __module__=__name__))
+        _buckets[day] = model
+    return model
+
+
+def ensure_bucket(day):
+    """ Model of bucket for day, table of bucket is created if not exists. Not for request time - it runs DDL """
+    table = bucket_table(day)
+    model = hit_bucket_model(day)
+    if table not in _tables:
+        if table not in connection.introspection.table_names():
+            try:
+                with connection.schema_editor() as editor:
+                    editor.create_model(model)
+            except DatabaseError as dberr:
+                # bucket just created by another worker
+                pass
+        _tables.add(table)
+    return model
+
+
+def bucket_model(day):
+    """ Model of bucket for day if table of bucket is created already (by clean_vhit), else None """
+    table = bucket_table(day)
+    if table not in _tables:
+        if time.time() - _missing.get(table, 0) < 60:
+            return None
+        if table not in connection.introspection.table_names():
+            _missing[table] = time.time()
+            return None
+        _missing.pop(table, None)
+        _tables.add(table)
+    return hit_bucket_model(day)
+
+
+def bucket_days():
+    result = []
+    for table in connection.introspection.table_names():
+        if table.startswith(BUCKET_PREFIX):
+            try:
+                result.append(datetime.strptime(table[len(BUCKET_PREFIX):], '%Y%m%d').date())
+            except ValueError as valerr:
+                pass
+    return sorted(result)
+
+
+def drop_bucket(day):
+    model = hit_bucket_model(day)
+    with connection.schema_editor() as editor:
+        editor.delete_model(model)
+    _tables.discard(bucket_table(day))
+    # model of dropped table is removed from registry too
+    _buckets.pop(day, None)
+    apps.all_models[model._meta.app_label].pop(model._meta.model_name, None)
+    apps.clear_cache()
+
+
+def rollup_day(day, *sources):
+    """
+    Save counts of hits per url and referer for day from all sources (querysets of hits) at once,
+    if not saved before
+    """
+    if VisitorHitRollup.objects.filter(date=day).exists():
+        return 0
+    counts = Counter()
+    for hits in sources:
+        for r in hits.order_by().values('url', 'referer').annotate(hits_count=Count('pk')):
+            counts[(r['url'], r['referer'])] += r['hits_count']
+    result = [VisitorHitRollup(date=day, url=url, referer=referer, hits=hits_count)
+              for (url, referer), hits_count in counts.items()]
+    with transaction.atomic():
+        VisitorHitRollup.objects.bulk_create(result, batch_size=500)
+    return len(result)
@@ -0,0 +1,121 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import threading
+from collections import deque
+from functools import lru_cache
+from uuid import uuid4
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS, IntegrityError
+from django.db.models import F
+
+from nnmware.core.models import IdSequence
+from nnmware.core.utils import setting
+
+# 9-digit ids: 100000000 - 999999999
+ID_MIN = 100000000
+ID_COUNT = 900000000
+# Feistel network works on 30 bits (2 halves of 15 bits), values out of ID_COUNT is walked again
+HALF_BITS = 15
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+# Ids of block is checked by taken() in chunks, so query has not more parameters then sqlite allows
+TAKEN_CHUNK = 500
+
+
+@lru_cache(maxsize=8)
+def _round_tables(secret):
+    """ Round function of every round for every half value, made once per secret """
+    tables = []
+    for i in range(ROUNDS):
+        table = []
+        for value in range(HALF_MASK + 1):
+            digest = hashlib.blake2b(b'%d:%d' % (i, value), key=secret, digest_size=4).digest()
+            table.append(int.from_bytes(digest, 'little') & HALF_MASK)
+        tables.append(table)
+    return tables
+
+
+def permute_id(n, secret):
+    """ Unique 9-digit id for counter value n (0 <= n < ID_COUNT), not guessable without secret """
+    if not 0 <= n < ID_COUNT:
+        raise ValueError('Id sequence is exhausted')
+    tables = _round_tables(secret)
+    x = n
+    while True:
+        left, right = x >> HALF_BITS, x & HALF_MASK
+        for table in tables:
+            left, right = right, left ^ table[right]
+        x = (left << HALF_BITS) | right
+        # cycle walking keeps permutation inside of ID_COUNT
+        if x < ID_COUNT:
+            return ID_MIN + x
+
+
+def reserve_block(name, size, using=DEFAULT_DB_ALIAS):
+    """
+    Reserve size values of sequence, returns (first value, secret). Row of sequence is locked and
+    increased in transaction of connection `using`, so in outer transaction block is returned
+    to sequence by its rollback, see IdAllocator.
+    """
+    sequences = IdSequence.objects.using(using)
+    with transaction.atomic(using=using):
+        if not list(sequences.select_for_update().filter(name=name).values_list('pk', flat=True)):
+            try:
+                with transaction.atomic(using=using):
+                    sequences.create(name=name, value=0, secret=uuid4().hex)
+            except IntegrityError as interr:
+                # created by another process
+                pass
+        sequences.filter(name=name).update(value=F('value') + size)
+        value, secret = sequences.filter(name=name).values_list('value', 'secret').get()
+    return value - size, secret.encode('ascii')
+
+
+class IdAllocator(object):
+    """
+    Allocator of unique 9-digit ids without query per id: process reserves block of counter values
+    and gives out their Feistel permutations. taken(ids) may return ids, which is used already
+    (e.g. made before allocator), they is skipped.
+    Block reserved in transaction is returned to sequence by rollback, so only first id of it is given
+    out in this transaction, others is kept after commit.
+    """
+
+    def __init__(self, name, block=None, taken=None, using=DEFAULT_DB_ALIAS):
+        self.name = name
+        self.using = using
+        self.block = block or setting('ID_BLOCK_SIZE', 1000)
+        self.taken = taken
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._ids = deque()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        start, secret = reserve_block(self.name, self.block, self.using)
+        ids = [permute_id(n, secret) for n in range(start, min(start + self.block, ID_COUNT))]
+        if not ids:
+            raise ValueError('Id sequence is exhausted')
+        if self.taken is not None:
+            taken = set()
+            for i in range(0, len(ids), TAKEN_CHUNK):
+                taken.update(self.taken(ids[i:i + TAKEN_CHUNK]))
+            ids = [i for i in ids if i not in taken]
+        if ids and connections[self.using].in_atomic_block:
+            ids, rest = ids[:1], ids[1:]
+            transaction.on_commit(lambda: self._ids.extend(rest), using=self.using)
+        self._ids.extend(ids)
+
+    def next(self):
+        if self._pid != os.getpid():
+            # forked worker - block of parent is given out by parent
+            self._reset()
+        with self._lock:
+            while not self._ids:
+                self._reserve()
+            return self._ids.popleft()
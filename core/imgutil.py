@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 import os
 import fnmatch
 import shutil
+from functools import lru_cache
 from urllib.parse import urljoin
 from PIL import Image, ImageOps
 
@@ -11,6 +12,7 @@ from django.conf import settings
 
 from nnmware.core.utils import setting
 from nnmware.core.file import get_path_from_url
+from nnmware.core.imgheader import read_image_size
 
 
 TMB_MASKS = ['%s_t*%s', '%s_aspect*%s', '%s_wm*%s']
@@ -57,13 +59,32 @@ def _has_thumbnail(photo_url, width=None, height=None,
 
 def make_thumbnail(photo_url, width=None, height=None, aspect=None,
                    root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
-    """ create thumbnail """
+    """ create thumbnail, once made thumbnail or its absence is taken from index until image is changed """
+    from nnmware.core.thumbnails import thumbnail_spec, lookup_thumbnail, register_thumbnail
 
     # one of width/height is required
     assert (width is not None) or (height is not None)
-    size = None
     if not photo_url:
         return None
+    spec = thumbnail_spec(width, height, aspect)
+    entry = lookup_thumbnail(photo_url, spec)
+    if entry is not None:
+        return entry.url
+    # get original image size
+    orig_w, orig_h = get_image_size(photo_url, root, url_root)
+    if (orig_w is None) and (orig_h is None):
+        # something is wrong with image, it is not probed again until it is changed
+        register_thumbnail(photo_url, spec, photo_url)
+        return photo_url
+    th_url = _render_thumbnail(photo_url, orig_w, orig_h, width, height, aspect, root, url_root)
+    # image without thumbnail is registered too, so next render is lookup only
+    register_thumbnail(photo_url, spec, th_url, orig_w, orig_h)
+    return th_url
+
+
+def _render_thumbnail(photo_url, orig_w, orig_h, width=None, height=None, aspect=None,
+                      root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    size = None
     th_url = _get_thumbnail_path(photo_url, width, height, aspect)
     th_path = get_path_from_url(th_url, root, url_root)
     photo_path = get_path_from_url(photo_url, root, url_root)
@@ -74,12 +95,6 @@ def make_thumbnail(photo_url, width=None, height=None, aspect=None,
             # if photo mtime is newer than thumbnail recreate thumbnail
             return th_url
     # make thumbnail
-    # get original image size
-    orig_w, orig_h = get_image_size(photo_url, root, url_root)
-    if (orig_w is None) and (orig_h is None):
-        # something is wrong with image
-        return photo_url
-
     # make proper size
     if (width is not None) and (height is not None):
         if (orig_w == width) and (orig_h == height):
@@ -99,7 +114,7 @@ def make_thumbnail(photo_url, width=None, height=None, aspect=None,
 
     # noinspection PyBroadException
     try:
-        img = Image.open(photo_path).copy()
+        img = _open_reduced(photo_path, size)
         if aspect:
             img = ImageOps.fit(img, size, Image.ANTIALIAS, (0.5, 0.5))
         img.thumbnail(size, Image.ANTIALIAS)
@@ -109,10 +124,38 @@ def make_thumbnail(photo_url, width=None, height=None, aspect=None,
     return th_url
 
 
+def _open_reduced(path, size):
+    """ Open image already downscaled close to size: JPEG is decoded at 1/2..1/8 scale by draft,
+        other formats is reduced by integer factor """
+    img = Image.open(path)
+    if img.format == 'JPEG':
+        img.draft(img.mode, size)
+    elif hasattr(img, 'reduce'):
+        factor = min(img.size[0] // size[0], img.size[1] // size[1])
+        if factor >= 2:
+            return img.reduce(factor)
+    return img.copy()
+
+
+def render_thumbnail_job(job):
+    """ Make thumbnail in worker process without database access.
+        job is (photo_url, width, height, aspect), returns job + (success, th_url, orig_w, orig_h)
+    """
+    photo_url, width, height, aspect = job
+    orig_w, orig_h = get_image_size(photo_url)
+    if (orig_w is None) and (orig_h is None):
+        return job + (False, None, None, None)
+    th_url = _render_thumbnail(photo_url, orig_w, orig_h, width, height, aspect)
+    return job + (th_url != photo_url, th_url, orig_w, orig_h)
+
+
 def remove_thumbnails(pic_url, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    from nnmware.core.thumbnails import invalidate_thumbnails, normalize_source
+
     if not pic_url:
         return  # empty url
     file_name = get_path_from_url(pic_url, root, url_root)
+    invalidate_thumbnails(normalize_source(pic_url, root, url_root))
     base, ext = os.path.splitext(os.path.basename(file_name))
     basedir = os.path.dirname(file_name)
     for item in TMB_MASKS:
@@ -162,17 +205,29 @@ def _get_thumbnail_url(photo_url, width=None, height=None, root=settings.MEDIA_R
         return photo_url
 
 
+@lru_cache(maxsize=setting('IMAGE_SIZE_CACHE', 4096))
+def _image_size(path, mtime):
+    # noinspection PyBroadException
+    try:
+        size = read_image_size(path)
+        if size is None:
+            # exotic format - header is read by PIL
+            size = Image.open(path).size
+    except:
+        # this goes to webserver error log
+        return None, None
+    return tuple(size)
+
+
 def get_image_size(photo_url, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
     """ returns image size.
     """
     path = get_path_from_url(photo_url, root, url_root)
-    # noinspection PyBroadException
     try:
-        size = Image.open(path).size
-    except:
-        # this goes to webserver error log
+        mtime = os.path.getmtime(path)
+    except OSError as oserr:
         return None, None
-    return size
+    return _image_size(path, mtime)
 
 
 ##################################################
@@ -0,0 +1,34 @@
+# nnmware(c)2012-2020
+
+import random
+from timeit import timeit
+
+from django.core.management.base import BaseCommand
+
+from nnmware.core import maps
+
+
+class Command(BaseCommand):
+    help = 'Benchmark distances from origins to landmarks: scalar haversine vs batch matrix'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--origins', type=int, default=50)
+        parser.add_argument('--landmarks', type=int, default=200)
+        parser.add_argument('--rounds', type=int, default=10)
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        origins = [(random.uniform(55, 56), random.uniform(37, 38)) for i in range(options['origins'])]
+        landmarks = [(random.uniform(55, 56), random.uniform(37, 38)) for i in range(options['landmarks'])]
+        rounds = options['rounds']
+        pairs = len(origins) * len(landmarks) * rounds
+        results = [
+            ('scalar', timeit(lambda: [[maps.distance(o, d) for d in landmarks] for o in origins], number=rounds)),
+            ('python', timeit(lambda: maps._distance_matrix_python(origins, landmarks), number=rounds)),
+        ]
+        if maps.numpy is not None:
+            results.append(('numpy', timeit(lambda: maps._distance_matrix_numpy(origins, landmarks), number=rounds)))
+        else:
+            self.stderr.write('NumPy is not installed')
+        for name, seconds in results:
+            self.stdout.write('%-8s %8.3f us/pair' % (name, seconds * 1000000 / pairs))
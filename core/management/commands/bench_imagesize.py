@@ -0,0 +1,47 @@
+# nnmware(c)2012-2020
+
+import os
+from timeit import timeit
+
+from PIL import Image
+from django.core.management.base import BaseCommand
+
+from nnmware.core.imgheader import read_image_size
+from nnmware.core.imgutil import _image_size
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+
+def pil_size(path):
+    return Image.open(path).size
+
+
+class Command(BaseCommand):
+    help = 'Benchmark image size probing: PIL open vs header reader vs cached reader'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory with images, e.g. hotel photos')
+        parser.add_argument('--rounds', type=int, default=3)
+
+    def handle(self, *args, **options):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(options['directory']):
+            paths.extend(os.path.join(dirpath, f) for f in filenames if f.lower().endswith(IMAGE_EXTENSIONS))
+        if not paths:
+            self.stderr.write('No images found')
+            return
+        mtimes = [os.path.getmtime(path) for path in paths]
+        for path in paths:
+            header = read_image_size(path)
+            if header is not None and tuple(header) != pil_size(path):
+                self.stderr.write('Sizes differ for %s' % path)
+        rounds = options['rounds']
+        checks = len(paths) * rounds
+        results = [
+            ('pil', timeit(lambda: [pil_size(path) for path in paths], number=rounds)),
+            ('header', timeit(lambda: [read_image_size(path) for path in paths], number=rounds)),
+            ('header+lru', timeit(lambda: [_image_size(p, m) for p, m in zip(paths, mtimes)], number=rounds)),
+        ]
+        self.stdout.write('%d images' % len(paths))
+        for name, seconds in results:
+            self.stdout.write('%-10s %8.3f us/image' % (name, seconds * 1000000 / checks))
@@ -0,0 +1,63 @@
+# nnmware(c)2012-2020
+
+from timeit import timeit
+
+from django.core.management.base import BaseCommand
+
+from nnmware.core.middleware import UNTRACKED_USER_AGENT, UNTRACKED_USER_AGENT_RE, is_untracked_agent
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.149 "
+    "Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_3) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.0.5 "
+    "Safari/605.1.15",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:74.0) Gecko/20100101 Firefox/74.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 13_3_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+    "Version/13.0.5 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 10; SM-G973F) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.119 "
+    "Mobile Safari/537.36",
+    "Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/79.0.3945.130 "
+    "YaBrowser/20.2.0.1043 Yowser/2.5 Safari/537.36",
+    "Opera/9.80 (Windows NT 6.1; WOW64) Presto/2.12.388 Version/12.18",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 (compatible; YandexBot/3.0; +http://yandex.com/bots)",
+    "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)",
+    "Mozilla/5.0 (compatible; AhrefsBot/6.1; +http://ahrefs.com/robot/)",
+    "Mozilla/5.0 (compatible; MJ12bot/v1.4.8; http://mj12bot.com/)",
+    "Mozilla/5.0 (compatible; Mail.RU_Bot/2.0; +http://go.mail.ru/help/robots)",
+    "Twitterbot/1.0",
+    "",
+]
+
+
+def loop_match(user_agent):
+    for ua in UNTRACKED_USER_AGENT:
+        if user_agent.find(ua) != -1:
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    help = 'Benchmark untracked user agent matching: old loop vs compiled regex vs cached regex'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs='?', help='File with one user agent per line')
+        parser.add_argument('--rounds', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        corpus = USER_AGENTS
+        if options['corpus']:
+            with open(options['corpus']) as f:
+                corpus = [line.strip()[:255] for line in f]
+        rounds = options['rounds']
+        for ua in corpus:
+            if loop_match(ua) != is_untracked_agent(ua):
+                self.stderr.write('Verdicts differ for %r' % ua)
+        checks = len(corpus) * rounds
+        results = [
+            ('loop', timeit(lambda: [loop_match(ua) for ua in corpus], number=rounds)),
+            ('regex', timeit(lambda: [UNTRACKED_USER_AGENT_RE.search(ua) for ua in corpus], number=rounds)),
+            ('regex+lru', timeit(lambda: [is_untracked_agent(ua) for ua in corpus], number=rounds)),
+        ]
+        for name, seconds in results:
+            self.stdout.write('%-10s %8.3f us/check' % (name, seconds * 1000000 / checks))
@@ -0,0 +1,26 @@
+# nnmware(c)2012-2020
+
+import json
+
+from django.core.management.base import BaseCommand
+
+from nnmware.core.buffer import buffer_stats
+
+
+class Command(BaseCommand):
+    help = 'Counters and flush latency of buffered writes (visitor hits, searches) of all running processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print stats in JSON for monitoring')
+
+    def handle(self, *args, **options):
+        stats = buffer_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2))
+            return
+        for s in stats:
+            self.stdout.write('%(buffer)s %(host)s:%(pid)s pending=%(pending)d added=%(added)d flushed=%(flushed)d '
+                              'dropped=%(dropped)d errors=%(errors)d callback_errors=%(callback_errors)d '
+                              'last_latency=%(last_latency)s max_latency=%(max_latency).3f' % s)
+        if not stats:
+            self.stdout.write('No running buffers')
@@ -1,14 +1,37 @@
 # nnmware(c)2012-2020
 
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from django.core.management.base import BaseCommand
+from django.utils.timezone import now
 
+from nnmware.core.hits import bucket_days, hit_bucket_model, rollup_day, drop_bucket, ensure_bucket
 from nnmware.core.models import VisitorHit
+from nnmware.core.utils import setting
 
 
 class Command(BaseCommand):
+    help = 'Roll up visitor hits of closed days and drop expired hits'
 
     def handle(self, *args, **options):
-        time_threshold = datetime.now() - timedelta(days=10)
-        VisitorHit.objects.filter(date__lt=time_threshold).delete()
+        today = now().date()
+        time_threshold = today - timedelta(days=setting('VISITOR_HIT_DAYS', 10))
+        buckets = bucket_days()
+        legacy_days = list(VisitorHit.objects.filter(date__date__lt=today).dates('date', 'day'))
+        # Hits of day may be in bucket and in not partitioned table, both is rolled up at once
+        for day in sorted(set(d for d in buckets if d < today) | set(legacy_days)):
+            sources = [VisitorHit.objects.filter(date__date=day)]
+            if day in buckets:
+                sources.append(hit_bucket_model(day).objects.all())
+            rollup_day(day, *sources)
+        for day in buckets:
+            if day < time_threshold:
+                drop_bucket(day)
+        # Hits in not partitioned table, deleted by day to keep locks short
+        for day in legacy_days:
+            if day < time_threshold:
+                VisitorHit.objects.filter(date__date=day).delete()
+        # Buckets is created ahead, not on request
+        if setting('VISITOR_HIT_BUCKETS', False):
+            ensure_bucket(today)
+            ensure_bucket(today + timedelta(days=1))
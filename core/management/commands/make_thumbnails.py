@@ -0,0 +1,45 @@
+# nnmware(c)2012-2020
+
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from nnmware.core.abstract import Pic
+from nnmware.core.imgutil import render_thumbnail_job
+from nnmware.core.models import Thumbnail
+from nnmware.core.thumbnails import enqueue_thumbnails, parse_spec, register_thumbnail, thumbnail_spec
+
+
+class Command(BaseCommand):
+    help = 'Make queued thumbnails in pool of processes. Interrupted run is resumed by next one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enqueue', action='store_true', help='Put thumbnails of all pictures in queue')
+        parser.add_argument('--workers', type=int, default=None, help='Number of processes, by default - CPU count')
+        parser.add_argument('--chunk', type=int, default=100)
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            for pic in Pic.objects.exclude(img='').only('img').iterator():
+                enqueue_thumbnails(pic.img.url)
+        queue = Thumbnail.objects.filter(ready=False)
+        total = queue.count()
+        done = failed = last = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                chunk = list(queue.filter(pk__gt=last).order_by('pk')[:options['chunk']])
+                if not chunk:
+                    break
+                last = chunk[-1].pk
+                jobs = [(t.source,) + parse_spec(t.spec) for t in chunk]
+                for source, width, height, aspect, success, th_url, orig_w, orig_h in \
+                        pool.map(render_thumbnail_job, jobs):
+                    spec = thumbnail_spec(width, height, aspect)
+                    if success:
+                        register_thumbnail(source, spec, th_url, orig_w, orig_h)
+                    else:
+                        # broken image - left for making on render as before
+                        Thumbnail.objects.filter(source=source, spec=spec).delete()
+                        failed += 1
+                    done += 1
+                self.stdout.write('%d/%d thumbnails done, %d failed' % (done, total, failed))
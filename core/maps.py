@@ -1,7 +1,7 @@
 # nnmware(c)2012-2020
 
 from __future__ import with_statement, unicode_literals
-from math import radians, sin, cos, sqrt, atan2
+from math import radians, sin, cos, sqrt, atan2, asin
 import xml.dom.minidom
 from urllib.parse import urlencode
 from urllib.request import urlopen
@@ -10,6 +10,11 @@ import http.client
 import json
 import socket
 
+try:
+    import numpy
+except ImportError as imperr:
+    numpy = None
+
 # OpenStreetMap
 OSM_URL = "http://nominatim.openstreetmap.org/search?format=json&polygon=1&addressdetails=1&%s"
 
@@ -98,6 +103,7 @@ def _get_coords(response):
 
 
 RADIUS = 6371  # Earth's mean radius in km
+MILE = 1.609344  # km
 
 
 def distance(origin, destiny):
@@ -127,6 +133,49 @@ def distance_to_object(origin, destiny):
     return RADIUS * c
 
 
+def _distance_matrix_numpy(origins, destinies):
+    lat1, lng1 = numpy.radians(numpy.asarray(origins, dtype=float).reshape(-1, 2)).T
+    lat2, lng2 = numpy.radians(numpy.asarray(destinies, dtype=float).reshape(-1, 2)).T
+    d_lat = lat1[:, None] - lat2[None, :]
+    d_long = lng1[:, None] - lng2[None, :]
+    a = numpy.sin(d_lat / 2) ** 2 + numpy.cos(lat1)[:, None] * numpy.cos(lat2)[None, :] * numpy.sin(d_long / 2) ** 2
+    a = numpy.clip(a, 0, 1)
+    return (2 * RADIUS * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))).tolist()
+
+
+def _distance_matrix_python(origins, destinies):
+    # radians and cosines is calculated once per point, not once per pair
+    points = [(radians(lat), radians(lng), cos(radians(lat))) for lat, lng in destinies]
+    diameter = 2 * RADIUS
+    result = []
+    for latitude, longitude in origins:
+        lat1, lng1 = radians(latitude), radians(longitude)
+        cos1 = cos(lat1)
+        row = []
+        for lat2, lng2, cos2 in points:
+            s_lat = sin((lat1 - lat2) / 2)
+            s_long = sin((lng1 - lng2) / 2)
+            row.append(diameter * asin(sqrt(min(s_lat * s_lat + cos1 * cos2 * s_long * s_long, 1))))
+        result.append(row)
+    return result
+
+
+def distance_matrix(origins, destinies):
+    """ List of rows of distances in km from every origin to every destiny,
+        origins and destinies is sequences of (latitude, longitude) """
+    if not origins or not destinies:
+        return [[] for o in origins]
+    if numpy is not None:
+        return _distance_matrix_numpy(origins, destinies)
+    return _distance_matrix_python(origins, destinies)
+
+
+def distances_to_objects(origin, destinies):
+    """ Distances in km from object to every object of destinies """
+    return distance_matrix([(origin.latitude, origin.longitude)],
+                           [(d.latitude, d.longitude) for d in destinies])[0]
+
+
 def places_near_object(origin, radius, model_db_name):
     query = """SELECT id, 3956 * 2 * ASIN(SQRT(POWER(SIN((%s - latitude) *
         0.0174532925 / 2), 2) + COS(%s * 0.0174532925) * COS(latitude * 0.0174532925) *
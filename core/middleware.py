@@ -2,12 +2,16 @@
 
 from __future__ import unicode_literals
 import json
+import re
+from functools import lru_cache
 
 from django.contrib import messages
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.timezone import now
 
+from nnmware.core.buffer import BulkBuffer
 from nnmware.core.utils import setting
+from nnmware.core.hits import bucket_model
 from nnmware.core.http import get_session_from_request
 from nnmware.core.models import VisitorHit
 
@@ -39,6 +43,26 @@ UNTRACKED_USER_AGENT = [
 ]
 
 
+def untracked_agent_matcher(agents):
+    """ Compile keywords of untracked user agents to one alternation regex """
+    return re.compile('|'.join(re.escape(ua) for ua in agents))
+
+
+UNTRACKED_USER_AGENT_RE = untracked_agent_matcher(UNTRACKED_USER_AGENT + list(setting('UNTRACKED_USER_AGENT', [])))
+
+
+@lru_cache(maxsize=setting('UNTRACKED_USER_AGENT_CACHE', 1024))
+def is_untracked_agent(user_agent):
+    return UNTRACKED_USER_AGENT_RE.search(user_agent) is not None
+
+
+# Buffered mode - hits is saved by background thread with bulk_create, see manage.py buffer_stats
+hit_buffer = BulkBuffer(VisitorHit, size=setting('VISITOR_HIT_BUFFER_SIZE', 1000),
+                        interval=setting('VISITOR_HIT_FLUSH_INTERVAL', 5),
+                        overflow=setting('VISITOR_HIT_BUFFER_OVERFLOW', 'oldest'),
+                        batch_size=setting('VISITOR_HIT_BATCH_SIZE', 500))
+
+
 class VisitorHitMiddleware(MiddlewareMixin):
     def process_request(self, request):
         if request.is_ajax():
@@ -47,11 +71,14 @@ class VisitorHitMiddleware(MiddlewareMixin):
             return
             # see if the user agent is not supposed to be tracked
         user_agent = request.META.get('HTTP_USER_AGENT', '')[:255]
-        for ua in UNTRACKED_USER_AGENT:
-            # if the keyword is found in the user agent, stop tracking
-            if user_agent.find(ua) != -1:
-                return
-        v = VisitorHit()
+        if is_untracked_agent(user_agent):
+            return
+        # bucket of day is created before by clean_vhit, without it hit is saved to common table
+        bucket = setting('VISITOR_HIT_BUCKETS', False) and bucket_model(now().date())
+        if bucket:
+            v = bucket()
+        else:
+            v = VisitorHit()
         if request.user.is_authenticated:
             v.user = request.user
         v.user_agent = user_agent
@@ -62,4 +89,7 @@ class VisitorHitMiddleware(MiddlewareMixin):
         v.hostname = request.META.get('REMOTE_HOST', '')[:100]
         v.url = request.get_full_path()
         v.date = now()
-        v.save()
+        if setting('VISITOR_HIT_BUFFER', False):
+            hit_buffer.add(v)
+        else:
+            v.save()
@@ -244,9 +244,9 @@ def update_doc_count(sender, instance, **kwargs):
     what.save()
 
 
-class VisitorHit(AbstractIP):
+class AbstractVisitorHit(AbstractIP):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('User'), blank=True,
-                             null=True, on_delete=models.CASCADE)
+                             null=True, on_delete=models.CASCADE, related_name='%(class)s_set')
     date = models.DateTimeField(verbose_name=_("Creation date"), default=now, db_index=True)
     session_key = models.CharField(max_length=40, verbose_name=_('Session key'), db_index=True)
     hostname = models.CharField(max_length=100, verbose_name=_('Hostname'), db_index=True)
@@ -254,12 +254,74 @@ class VisitorHit(AbstractIP):
     url = models.CharField(max_length=255, verbose_name=_('URL'), db_index=True)
     secure = models.BooleanField(_('Is secure'), default=False, db_index=True)
 
+    class Meta:
+        ordering = ['-date']
+        abstract = True
+
+
+class VisitorHit(AbstractVisitorHit):
+
     class Meta:
         ordering = ['-date']
         verbose_name = _("Visitor hit")
         verbose_name_plural = _("Visitors hits")
 
 
+class VisitorHitRollup(models.Model):
+    """
+    Daily count of visitor hits per URL and referer
+    """
+    date = models.DateField(verbose_name=_("Date"), db_index=True)
+    url = models.CharField(max_length=255, verbose_name=_('URL'), db_index=True)
+    referer = models.TextField(verbose_name=_('Referer'), blank=True)
+    hits = models.PositiveIntegerField(verbose_name=_('Hits'), default=0)
+
+    class Meta:
+        ordering = ['-date', '-hits']
+        verbose_name = _("Visitor hits per day")
+        verbose_name_plural = _("Visitors hits per day")
+
+    def __str__(self):
+        return "%s :: %s :: %s" % (self.date, self.url, self.hits)
+
+
+class Thumbnail(models.Model):
+    """
+    Generated thumbnail of image with size of original image
+    """
+    source = models.CharField(max_length=255, verbose_name=_('Source URL'), db_index=True)
+    mtime = models.FloatField(verbose_name=_('Source modification time'), default=0)
+    spec = models.CharField(max_length=50, verbose_name=_('Specification'))
+    url = models.CharField(max_length=255, verbose_name=_('Thumbnail URL'), null=True, blank=True)
+    width = models.PositiveIntegerField(verbose_name=_('Source width'), null=True, blank=True)
+    height = models.PositiveIntegerField(verbose_name=_('Source height'), null=True, blank=True)
+    ready = models.BooleanField(verbose_name=_('Ready'), default=True, db_index=True)
+
+    class Meta:
+        unique_together = ('source', 'spec')
+        verbose_name = _("Thumbnail")
+        verbose_name_plural = _("Thumbnails")
+
+    def __str__(self):
+        return "%s :: %s" % (self.source, self.spec)
+
+
+class IdSequence(models.Model):
+    """
+    Counter of allocated ids with secret of their permutation, see nnmware.core.idgen
+    """
+    name = models.CharField(max_length=50, verbose_name=_('Name'), unique=True)
+    value = models.BigIntegerField(verbose_name=_('Value'), default=0)
+    secret = models.CharField(max_length=32, verbose_name=_('Secret'))
+
+    class Meta:
+        verbose_name = _("Id sequence")
+        verbose_name_plural = _("Id sequences")
+
+    def __str__(self):
+        return "%s :: %s" % (self.name, self.value)
+
+
 class EmailValidationManager(Manager):
     """
     Email validation manager
@@ -40,6 +40,7 @@ def parse_currency(on_date=None):
     rate_date = datetime.date(y, m, d)
     lst_currency = parse_xml_currency(currency_xml_input(sdate))
     from nnmware.apps.money.models import ExchangeRate, Currency
+    from nnmware.apps.money.exchange import invalidate_rates
     currencies = Currency.objects.all().values_list('code', flat=True)
     for currency in lst_currency:
         charcode = currency['CharCode']
@@ -57,4 +58,5 @@ def parse_currency(on_date=None):
             if not rate.rate:
                 rate.rate = f(currency['Value'])
             rate.save()
+    invalidate_rates()
     return None
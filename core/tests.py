@@ -1,6 +1,7 @@
 # nnmware(c)2012-2020
 
 import unittest
+from .idgen import permute_id, IdAllocator, ID_MIN, ID_COUNT, TAKEN_CHUNK
 from .models import Tag
 
 
@@ -15,3 +16,36 @@ class TagTestCase(unittest.TestCase):
         """ Count of tags with first letter"""
         self.assertEqual(self.tag3.lettercount(), 2)
         self.assertEqual(self.tag2.lettercount(), 1)
+
+
+class SystemIdTestCase(unittest.TestCase):
+    def test_unique_ids(self):
+        """ Millions of permuted ids is unique and has 9 digits """
+        ids = set()
+        for n in range(2000000):
+            i = permute_id(n, b'0123456789abcdef')
+            self.assertTrue(ID_MIN <= i < ID_MIN + ID_COUNT)
+            ids.add(i)
+        self.assertEqual(len(ids), 2000000)
+
+    def test_secret(self):
+        """ Ids depend on secret """
+        first = [permute_id(n, b'0123456789abcdef') for n in range(100)]
+        second = [permute_id(n, b'fedcba9876543210') for n in range(100)]
+        self.assertNotEqual(first, second)
+
+
+class IdAllocatorTestCase(unittest.TestCase):
+    def test_taken_chunks(self):
+        """ Ids of block is checked by chunks, taken ids is skipped and blocks not overlap """
+        chunks = []
+
+        def taken(ids):
+            chunks.append(len(ids))
+            return ids[:1]
+
+        allocator = IdAllocator('test_taken_chunks', block=2 * TAKEN_CHUNK + 10, taken=taken)
+        ids = set(allocator.next() for n in range(2 * TAKEN_CHUNK + 7))
+        self.assertEqual(chunks, [TAKEN_CHUNK, TAKEN_CHUNK, 10])
+        other = IdAllocator('test_taken_chunks', block=100)
+        self.assertFalse(ids & set(other.next() for n in range(100)))
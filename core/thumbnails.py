@@ -0,0 +1,144 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+import os
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from nnmware.core.file import get_path_from_url
+from nnmware.core.models import Thumbnail
+from nnmware.core.utils import setting
+
+THUMBNAILS_VERSION_KEY = 'core_thumbnails_version'
+
+ThumbnailEntry = namedtuple('ThumbnailEntry', 'mtime url width height')
+
+# Thumbnails made for every uploaded image: (width, height, aspect)
+THUMBNAIL_SPECS = [(113, 75, 1), (60, 60, None), (60, 60, 1)]
+
+THUMBNAILS_INVALIDATED_KEY = 'core_thumbnails_invalidated_%s'
+# Versions after which index is dropped at all instead of reading of invalidated sources
+THUMBNAILS_INVALIDATED_LOG = 1000
+
+# Process level index: source url -> {spec: ThumbnailEntry}
+_index = dict()
+_state = dict(version=None, checked=0)
+
+
+def thumbnail_spec(width=None, height=None, aspect=None):
+    spec = 'w%s_h%s' % (width or '', height or '')
+    if aspect:
+        spec += '_aspect'
+    return spec
+
+
+def parse_spec(spec):
+    """ (width, height, aspect) from spec """
+    parts = spec.split('_')
+    width = int(parts[0][1:]) if parts[0][1:] else None
+    height = int(parts[1][1:]) if parts[1][1:] else None
+    return width, height, 1 if 'aspect' in parts else None
+
+
+def normalize_source(source, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    """ Media url of source given as url or as path of file, other urls is returned as is """
+    if '://' in source:
+        return source
+    if source.startswith(url_root):
+        path = os.path.normpath(os.path.join(root, source[len(url_root):].lstrip('/')))
+    else:
+        path = os.path.normpath(source)
+    relpath = os.path.relpath(path, root)
+    if relpath.startswith(os.pardir):
+        return source
+    return url_root + relpath.replace('\\', '/')
+
+
+def source_mtime(source, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    try:
+        return os.path.getmtime(get_path_from_url(source, root, url_root))
+    except OSError as oserr:
+        return None
+
+
+def _check_version():
+    """
+    Sources invalidated in any process is dropped from index, checked not often then once in period.
+    Index is dropped at all if it is too old for log of invalidated sources.
+    """
+    if time.time() - _state['checked'] < setting('THUMBNAIL_INDEX_CHECK', 60):
+        return
+    version = cache.get(THUMBNAILS_VERSION_KEY) or 0
+    old = _state['version']
+    if old is None or not 0 <= version - old <= THUMBNAILS_INVALIDATED_LOG:
+        _index.clear()
+    elif version != old:
+        keys = [THUMBNAILS_INVALIDATED_KEY % v for v in range(old + 1, version + 1)]
+        invalidated = cache.get_many(keys)
+        if len(invalidated) < len(keys):
+            # log is expired
+            _index.clear()
+        for source in invalidated.values():
+            _index.pop(source, None)
+    _state['version'] = version
+    _state['checked'] = time.time()
+
+
+def lookup_thumbnail(source, spec):
+    """
+    Registered thumbnail of source or None. Entry is valid for modification time of source only,
+    which is checked by one stat of source unless THUMBNAIL_CHECK_MTIME is off.
+    Entry of image, which has no thumbnail, has url of image itself (or None for image of same size).
+    """
+    _check_version()
+    source = normalize_source(source)
+    entry = _index.get(source, {}).get(spec)
+    if entry is None:
+        try:
+            t = Thumbnail.objects.get(source=source, spec=spec, ready=True)
+        except Thumbnail.DoesNotExist:
+            return None
+        entry = ThumbnailEntry(t.mtime, t.url, t.width, t.height)
+        _index.setdefault(source, {})[spec] = entry
+    if setting('THUMBNAIL_CHECK_MTIME', True) and entry.mtime != (source_mtime(source) or 0):
+        return None
+    return entry
+
+
+def register_thumbnail(source, spec, url, width=None, height=None, mtime=None):
+    source = normalize_source(source)
+    if mtime is None:
+        mtime = source_mtime(source) or 0
+    Thumbnail.objects.update_or_create(source=source, spec=spec,
+                                       defaults=dict(mtime=mtime, url=url, width=width, height=height, ready=True))
+    entry = ThumbnailEntry(mtime, url, width, height)
+    _index.setdefault(source, {})[spec] = entry
+    return entry
+
+
+def invalidate_thumbnails(source):
+    """ Forget thumbnails of source (url or path) in this process and in all others, which share cache """
+    source = normalize_source(source)
+    Thumbnail.objects.filter(source=source).delete()
+    _index.pop(source, None)
+    try:
+        version = cache.incr(THUMBNAILS_VERSION_KEY)
+    except ValueError as valerr:
+        version = 1
+        cache.set(THUMBNAILS_VERSION_KEY, version, None)
+    cache.set(THUMBNAILS_INVALIDATED_KEY % version, source, setting('THUMBNAIL_INVALIDATED_TTL', 86400))
+
+
+def enqueue_thumbnails(source, specs=None):
+    """ Put thumbnails of source in queue of pre-generation, made thumbnails will be made again """
+    source = normalize_source(source)
+    if specs is None:
+        specs = setting('THUMBNAIL_SPECS', THUMBNAIL_SPECS)
+    for width, height, aspect in specs:
+        spec = thumbnail_spec(width, height, aspect)
+        Thumbnail.objects.update_or_create(source=source, spec=spec, defaults=dict(ready=False))
+        _index.get(source, {}).pop(spec, None)
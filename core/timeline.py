@@ -0,0 +1,128 @@
+# nnmware(c)2012-2020
+
+from __future__ import unicode_literals
+
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.cache import cache
+
+from nnmware.core.utils import setting
+
+
+def as_day(d):
+    if isinstance(d, datetime):
+        return d.date()
+    return d
+
+
+class Timeline(object):
+    """
+    History of values of one key ordered by date, answers "latest value as of date" by bisect
+    """
+
+    def __init__(self, rows):
+        self.dates = []
+        self.values = []
+        for on_date, value in rows:
+            self.dates.append(as_day(on_date))
+            self.values.append(value)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def at(self, on_date, default=None):
+        """ Value of latest date not after on_date """
+        i = bisect_right(self.dates, as_day(on_date))
+        if not i:
+            return default
+        return self.values[i - 1]
+
+    def each(self, dates, default=None):
+        """ Values as of every date of dates """
+        return [self.at(on_date, default) for on_date in dates]
+
+    def between(self, from_date, to_date):
+        """ [(date, value)] with dates in period from_date - to_date (inclusive) """
+        i = bisect_left(self.dates, as_day(from_date))
+        j = bisect_right(self.dates, as_day(to_date))
+        return list(zip(self.dates[i:j], self.values[i:j]))
+
+
+class TimelineCache(object):
+    """
+    Process level LRU of timelines per key. loader(key) returns rows (date, value) ordered by date.
+    Key invalidated in one process is dropped in all others, which share cache: every invalidation
+    is written to short log in cache, other processes read log not often then once in TIMELINE_CHECK seconds.
+    """
+    log_size = 1000
+
+    def __init__(self, name, loader, size=None):
+        self.name = name
+        self.loader = loader
+        self.size = size or setting('TIMELINE_CACHE_SIZE', 1000)
+        self._timelines = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = 0
+
+    @property
+    def version_key(self):
+        return 'timeline_version_%s' % self.name
+
+    def _log_key(self, version):
+        return 'timeline_invalidated_%s_%s' % (self.name, version)
+
+    def version(self):
+        return cache.get(self.version_key) or 0
+
+    def _check_version(self):
+        if time.time() - self._checked < setting('TIMELINE_CHECK', 1):
+            return
+        version = self.version()
+        old = self._version
+        if version != old:
+            keys = []
+            if old is not None and 0 < version - old <= self.log_size:
+                keys = [self._log_key(v) for v in range(old + 1, version + 1)]
+                invalidated = cache.get_many(keys)
+            with self._lock:
+                if keys and len(invalidated) == len(keys) and (None,) not in invalidated.values():
+                    for key, in invalidated.values():
+                        self._timelines.pop(key, None)
+                else:
+                    # log is expired or all keys is invalidated
+                    self._timelines.clear()
+            self._version = version
+        self._checked = time.time()
+
+    def get(self, key):
+        self._check_version()
+        with self._lock:
+            timeline = self._timelines.get(key)
+            if timeline is not None:
+                self._timelines.move_to_end(key)
+                return timeline
+        timeline = Timeline(self.loader(key))
+        with self._lock:
+            self._timelines[key] = timeline
+            while len(self._timelines) > self.size:
+                self._timelines.popitem(last=False)
+        return timeline
+
+    def invalidate(self, key=None):
+        """ Drop timeline of key (all timelines if key is None) here and in other processes """
+        with self._lock:
+            if key is None:
+                self._timelines.clear()
+            else:
+                self._timelines.pop(key, None)
+        try:
+            version = cache.incr(self.version_key)
+        except ValueError as valerr:
+            version = 1
+            cache.set(self.version_key, version, None)
+        cache.set(self._log_key(version), (key,), setting('TIMELINE_LOG_TTL', 3600))
@@ -16,7 +16,7 @@ from bs4 import BeautifulSoup
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
+from django.core.mail import send_mail, EmailMessage, get_connection
 from django.template.loader import render_to_string
 from django.utils.encoding import smart_text
 from django.utils.timezone import now
@@ -292,6 +292,26 @@ def send_template_mail(subject, body, mail_dict, recipients):
         pass
 
 
+def send_template_mass_mail(messages, connection=None):
+    """
+    Send list of (subject, body, mail_dict, recipients) through one connection to mail server.
+    Returns count of sent messages.
+    """
+    emails = []
+    for subject, body, mail_dict, recipients in messages:
+        # noinspection PyBroadException
+        try:
+            subject = ''.join(render_to_string(subject, mail_dict).splitlines())
+            body = render_to_string(body, mail_dict)
+        except:
+            continue
+        emails.append(EmailMessage(subject, body, settings.EMAIL_HOST_USER, recipients))
+    if not emails:
+        return 0
+    connection = connection or get_connection(fail_silently=True)
+    return connection.send_messages(emails) or 0
+
+
 def setting(name, default=None):
     """Return setting value for given name or default value."""
     return getattr(settings, name, default)